@@ -1,10 +1,16 @@
+import asyncio
 import logging
+import signal
 
 from telethon.sync import events
 
-from service.channel_sync import sync_channels_with_client
+from service.channel_sync import run_periodic_channel_sync
 from service.config import client, TARGET_USER
-from service.main_handler import handle_new_message
+from service.db import db
+from service.delivery import delivery_queue
+from service.digest import digest_buffer, setup_digest_handlers
+from service.ingest import dropped_updates, ingest_queue
+from service.read_ack import read_acknowledger
 from service.process_history import process_unread_messages
 from service.channel_updates import setup_channel_update_handlers
 from service.web import start_web_server
@@ -12,23 +18,65 @@ from service.web import start_web_server
 
 if __name__ == "__main__":
 
-    setup_channel_update_handlers(client)
-    client.add_event_handler(handle_new_message, events.Album())
-    client.add_event_handler(handle_new_message, events.NewMessage(incoming=True))
+    channel_updates = setup_channel_update_handlers(client)
+    setup_digest_handlers(client)
+    client.add_event_handler(ingest_queue.submit, events.Album())
+    client.add_event_handler(ingest_queue.submit, events.NewMessage(incoming=True))
 
     async def app_main():
+        delivery_queue.start()
+        ingest_queue.start()
+        dropped_updates.start()
+        read_acknowledger.start()
         runner = await start_web_server(client)
         await client.send_message(TARGET_USER, "Клиент успешно запущен!")
         logging.info("Client started")
+        channel_sync = asyncio.create_task(run_periodic_channel_sync(client))
+        stopped = False
+
+        async def stop_services():
+            nonlocal stopped
+            if stopped:
+                return
+            stopped = True
+            channel_sync.cancel()
+            await asyncio.gather(channel_sync, return_exceptions=True)
+            await dropped_updates.stop()
+            await ingest_queue.stop()
+            await channel_updates.flush()
+            digest_buffer.flush()
+            # Delivered notifications release the holds on checkpoints and read marks, so they go first
+            await delivery_queue.stop()
+            await read_acknowledger.stop()
+            db.flush_pending_writes()
+
+        async def shutdown():
+            # Final acks, digests and notifications need the connection, run_until_disconnected drops it
+            try:
+                await stop_services()
+            finally:
+                await client.disconnect()
+
+        shutdown_tasks = []
+
+        def request_shutdown():
+            if not shutdown_tasks:
+                logging.info("Stopping")
+                shutdown_tasks.append(asyncio.create_task(shutdown()))
+
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, request_shutdown)
+            except NotImplementedError:
+                pass
         try:
-            updated, removed = await sync_channels_with_client(client)
-            logging.info("Channels refreshed: updated=%s, removed=%s", updated, removed)
-        except Exception:
-            logging.exception("Failed to refresh channels on startup")
-        await process_unread_messages()
-        try:
+            await process_unread_messages()
             await client.run_until_disconnected()
         finally:
+            await asyncio.gather(*shutdown_tasks, return_exceptions=True)
+            # The connection was lost on its own: local writes are still flushed
+            await stop_services()
             await runner.cleanup()
 
 
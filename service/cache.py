@@ -10,19 +10,24 @@ class Cache:
 
     Attributes:
         ttl (int): The default time-to-live (TTL) duration for cache entries in seconds.
+        max_size (int | None): The maximal number of entries, the oldest ones are evicted first.
     """
 
     ttl = DEFAULLT_TTL
+    max_size = None
 
-    def __init__(self, ttl: int = None):
+    def __init__(self, ttl: int = None, max_size: int = None):
         """
         Initializes the Cache object.
 
         Args:
             ttl (int, optional): The default TTL for cache entries. If not provided, uses the class-level ttl.
+            max_size (int, optional): The maximal number of entries. If not provided, the cache is unbounded.
         """
         if ttl:
             self.ttl = ttl
+        if max_size:
+            self.max_size = max_size
         self.cache = {}
         self.lock = threading.Lock()
         cleanup_thread = threading.Thread(target=self.cleanup, daemon=True)
@@ -40,7 +45,10 @@ class Cache:
         if not ttl:
             ttl = self.ttl
         with self.lock:
+            self.cache.pop(key, None)
             self.cache[key] = (value, time.time() + ttl)
+            if self.max_size and len(self.cache) > self.max_size:
+                del self.cache[next(iter(self.cache))]
 
     def get(self, key):
         """
@@ -103,6 +111,12 @@ class Cache:
                     del self.cache[key]
             time.sleep(max(0.5, self.ttl / 30))
 
+    def __len__(self):
+        """
+        Returns the number of stored entries, including expired ones not cleaned up yet.
+        """
+        return len(self.cache)
+
     def __str__(self):
         """
         Returns a string representation of the cache.
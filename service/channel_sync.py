@@ -1,12 +1,21 @@
 from __future__ import annotations
 
+import asyncio
 import logging
-from typing import Dict, List, Optional, Tuple
+import random
+from typing import Dict, List, Optional, Set, Tuple
 
 from telethon import functions
-from telethon.errors import ChannelInvalidError, ChatAdminRequiredError
+from telethon.errors import FloodWaitError
 from telethon.tl import types as tl_types
-
+from telethon.utils import get_peer_id
+
+from service.config import (
+    CHANNEL_SYNC_INTERVAL_SECONDS,
+    CHANNEL_SYNC_JITTER,
+    INVITE_LINK_CONCURRENCY,
+    INVITE_LINK_RETRY_HOURS,
+)
 from service.db import ChannelRecord, db
 
 
@@ -23,7 +32,20 @@ def _can_export_invite(entity) -> bool:
     return False
 
 
-async def _resolve_invite_link(client, entity, existing: Optional[str]) -> str | None:
+async def _resolve_invite_link(
+    client,
+    entity,
+    existing: Optional[str],
+    semaphore: Optional[asyncio.Semaphore] = None,
+    failures: Optional[Dict[int, str]] = None,
+    allow_export: bool = True,
+) -> str | None:
+    """
+    Returns a link to the chat: the stored one, a public t.me link or an exported invite.
+
+    Exports run under the semaphore. Failed ones are reported in ``failures`` (chat id -> reason)
+    so the caller can persist them; ``allow_export=False`` skips the export altogether.
+    """
     if existing:
         return existing
 
@@ -35,14 +57,20 @@ async def _resolve_invite_link(client, entity, existing: Optional[str]) -> str |
     if isinstance(entity, (tl_types.Chat, tl_types.Channel)):
         if getattr(entity, "username", None):
             return f"https://t.me/{entity.username}"
-        if not _can_export_invite(entity):
+        if not allow_export or not _can_export_invite(entity):
             return None
         try:
-            result = await client(functions.messages.ExportChatInviteRequest(peer=entity))
+            if semaphore is None:
+                result = await client(functions.messages.ExportChatInviteRequest(peer=entity))
+            else:
+                async with semaphore:
+                    result = await client(functions.messages.ExportChatInviteRequest(peer=entity))
             return getattr(result, "link", None)
-        except (ChannelInvalidError, ChatAdminRequiredError):
+        except FloodWaitError:
             return None
-        except Exception:
+        except Exception as exc:
+            if failures is not None:
+                failures[get_peer_id(entity)] = exc.__class__.__name__
             return None
 
     return None
@@ -63,9 +91,21 @@ def _detect_kind(dialog, entity) -> str:
     return "unknown"
 
 
-async def fetch_dialog_channels(client, cached_links: Optional[Dict[int, Optional[str]]] = None) -> List[ChannelRecord]:
+async def fetch_dialog_channels(
+    client,
+    cached_links: Optional[Dict[int, Optional[str]]] = None,
+    skip_export: Optional[Set[int]] = None,
+    failures: Optional[Dict[int, str]] = None,
+) -> List[ChannelRecord]:
+    """
+    Lists non-user dialogs as channel records.
+
+    Invite links are resolved concurrently, at most INVITE_LINK_CONCURRENCY exports at a time.
+    Chats in ``skip_export`` get no export attempt, failed exports are added to ``failures``.
+    """
     cached_links = cached_links or {}
-    records: List[ChannelRecord] = []
+    skip_export = skip_export or set()
+    pending: List[Tuple[object, int, str, str | None, str]] = []
     async for dialog in client.iter_dialogs():
         try:
             entity = dialog.entity
@@ -74,35 +114,111 @@ async def fetch_dialog_channels(client, cached_links: Optional[Dict[int, Optiona
             if not title and isinstance(entity, tl_types.User):
                 title = " ".join(filter(None, [entity.first_name, entity.last_name])).strip()
             title = title or f"Chat {chat_id}"
-            invite_link = await _resolve_invite_link(client, entity, cached_links.get(chat_id))
             username = getattr(entity, "username", None)
             kind = _detect_kind(dialog, entity)
             if kind == "user":
                 continue
-            records.append(
-                ChannelRecord(
-                    id=chat_id,
-                    title=title,
-                    invite_link=invite_link,
-                    username=username,
-                    kind=kind,
-                )
-            )
+            pending.append((entity, chat_id, title, username, kind))
         except Exception as exc:
             logging.warning("Skipping dialog due to error: %s", exc)
             continue
+
+    semaphore = asyncio.Semaphore(max(1, INVITE_LINK_CONCURRENCY))
+    links = await asyncio.gather(
+        *(
+            _resolve_invite_link(
+                client,
+                entity,
+                cached_links.get(chat_id),
+                semaphore=semaphore,
+                failures=failures,
+                allow_export=chat_id not in skip_export,
+            )
+            for entity, chat_id, _, _, _ in pending
+        ),
+        return_exceptions=True,
+    )
+    records: List[ChannelRecord] = []
+    for (entity, chat_id, title, username, kind), invite_link in zip(pending, links):
+        if isinstance(invite_link, Exception):
+            logging.warning("Invite link of %s not resolved: %s", chat_id, invite_link)
+            invite_link = None
+        records.append(
+            ChannelRecord(
+                id=chat_id,
+                title=title,
+                invite_link=invite_link,
+                username=username,
+                kind=kind,
+            )
+        )
     return records
 
 
+_sync_lock: asyncio.Lock | None = None
+
+
+def _fingerprint(record: ChannelRecord) -> Tuple:
+    return record.title, record.invite_link, record.username, record.kind
+
+
 async def sync_channels_with_client(client) -> Tuple[int, int]:
-    """Refresh stored channels using the provided Telegram client."""
+    """
+    Refresh stored channels using the provided Telegram client.
+
+    Only rows whose fields differ from the cached records are written.
+    Returns the number of changed and removed rows.
+    """
+    global _sync_lock
+    if _sync_lock is None:
+        _sync_lock = asyncio.Lock()
+    async with _sync_lock:
+        return await _sync_channels(client)
+
+
+async def _sync_channels(client) -> Tuple[int, int]:
     existing_channels = db.list_channels()
     existing_links = {channel.id: channel.invite_link for channel in existing_channels if channel.invite_link}
     existing_ids = {channel.id for channel in existing_channels}
-    records = await fetch_dialog_channels(client, cached_links=existing_links)
+    failed_recently = db.get_recent_invite_link_failures(INVITE_LINK_RETRY_HOURS * 60 * 60)
+    failures: Dict[int, str] = {}
+    records = await fetch_dialog_channels(
+        client, cached_links=existing_links, skip_export=failed_recently, failures=failures
+    )
+    db.record_invite_link_failures(failures)
+    db.clear_invite_link_failures(
+        [record.id for record in records if record.invite_link and record.id in failed_recently]
+    )
     fetched_ids = {record.id for record in records}
     removed_ids = [channel_id for channel_id in existing_ids if channel_id not in fetched_ids]
     removed = db.delete_channels(removed_ids) if removed_ids else 0
-    db.delete_channels_by_kind("user")
-    updated = db.upsert_channels(records)
+    if any(channel.kind == "user" for channel in existing_channels):
+        db.delete_channels_by_kind("user")
+    changed = []
+    for record in records:
+        cached = db.get_channel(record.id)
+        if cached is None or _fingerprint(cached) != _fingerprint(record):
+            changed.append(record)
+    updated = db.upsert_channels(changed)
     return updated, removed
+
+
+async def run_periodic_channel_sync(
+    client,
+    interval: float = CHANNEL_SYNC_INTERVAL_SECONDS,
+    jitter: float = CHANNEL_SYNC_JITTER,
+) -> None:
+    """
+    Syncs channels right away and then every ``interval`` seconds, shifted by up to ``jitter``
+    of the interval in either direction so restarts do not line the scans up.
+    """
+    while True:
+        try:
+            updated, removed = await sync_channels_with_client(client)
+            logging.info("Channels refreshed: updated=%s, removed=%s", updated, removed)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception("Failed to refresh channels")
+        delay = interval * (1 + random.uniform(-jitter, jitter))
+        await asyncio.sleep(max(60.0, delay))
@@ -1,11 +1,13 @@
+import asyncio
 import logging
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
 
 from telethon import events
 from telethon.tl import types as tl_types
 from telethon.utils import get_peer_id
 
 from service.channel_sync import _detect_kind
+from service.config import CHANNEL_UPDATE_DEBOUNCE_SECONDS
 from service.db import ChannelRecord, db
 from service.utils import format_user_name
 
@@ -57,44 +59,109 @@ def _build_record(entity, existing: Optional[ChannelRecord] = None, forced_kind:
     )
 
 
-async def _upsert_entity(entity, forced_kind: Optional[str] = None) -> None:
+def _entity_record(entity, forced_kind: Optional[str] = None) -> Optional[ChannelRecord]:
     try:
+        existing_id = int(get_peer_id(entity))
+    except Exception:
+        existing_id = getattr(entity, "id", None)
+    existing = db.get_channel(int(existing_id)) if existing_id is not None else None
+    return _build_record(entity, existing=existing, forced_kind=forced_kind)
+
+
+class ChannelUpdateBuffer:
+    """
+    Coalesces channel updates by peer and applies them once per ``window`` seconds.
+
+    Peers that need a fresh entity are fetched with one list-form ``get_entity`` call,
+    entities that arrived with an event are used as they are. All resulting records are
+    written with a single ``upsert_channels`` transaction.
+    """
+
+    def __init__(self, client, window: float = 5):
+        self.client = client
+        self.window = max(0.1, window)
+        # peer id -> (peer or entity, forced kind, whether it is already an entity)
+        self._pending: Dict[int, Tuple[object, Optional[str], bool]] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._task: asyncio.Task | None = None
+
+    def add_peer(self, peer, forced_kind: Optional[str] = None) -> None:
+        key = get_peer_id(peer)
+        if key not in self._pending:
+            self._pending[key] = (peer, forced_kind, False)
+        self._schedule()
+
+    def add_entity(self, entity, forced_kind: Optional[str] = None) -> None:
+        self._pending[get_peer_id(entity)] = (entity, forced_kind, True)
+        self._schedule()
+
+    def _schedule(self) -> None:
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._start_flush)
+
+    def _start_flush(self) -> None:
+        self._timer = None
+        self._task = asyncio.create_task(self.flush())
+
+    async def _fetch(self, peers: List[object]) -> List[object]:
         try:
-            existing_id = int(get_peer_id(entity))
+            return list(await self.client.get_entity(peers))
         except Exception:
-            existing_id = getattr(entity, "id", None)
-        existing = db.get_channel(int(existing_id)) if existing_id is not None else None
-        record = _build_record(entity, existing=existing, forced_kind=forced_kind)
-        if record:
-            db.upsert_channels([record])
-    except Exception:
-        logging.exception("Failed to upsert chat/entity")
-
+            logging.warning("Batched entity fetch of %s peers failed, fetching one by one", len(peers))
+        entities = []
+        for peer in peers:
+            try:
+                entities.append(await self.client.get_entity(peer))
+            except Exception:
+                logging.exception("Failed to fetch entity for %s", peer)
+                entities.append(None)
+        return entities
+
+    async def flush(self) -> int:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        to_fetch = [(item, kind) for item, kind, resolved in pending.values() if not resolved]
+        entities = [(item, kind) for item, kind, resolved in pending.values() if resolved]
+        if to_fetch:
+            fetched = await self._fetch([peer for peer, _ in to_fetch])
+            entities.extend((entity, kind) for entity, (_, kind) in zip(fetched, to_fetch) if entity is not None)
+        records = []
+        for entity, forced_kind in entities:
+            try:
+                record = _entity_record(entity, forced_kind)
+            except Exception:
+                logging.exception("Failed to build a record for %s", entity)
+                continue
+            if record:
+                records.append(record)
+        try:
+            db.upsert_channels(records)
+        except Exception:
+            logging.exception("Failed to upsert %s chats", len(records))
+            return 0
+        logging.info("Channel updates applied: %s of %s peers", len(records), len(pending))
+        return len(records)
 
-async def _refresh_peer(client, peer, forced_kind: Optional[str] = None) -> None:
-    try:
-        entity = await client.get_entity(peer)
-    except Exception:
-        logging.exception("Failed to fetch entity for %s", peer)
-        return
-    await _upsert_entity(entity, forced_kind=forced_kind)
 
+def setup_channel_update_handlers(client) -> ChannelUpdateBuffer:
+    buffer = ChannelUpdateBuffer(client, CHANNEL_UPDATE_DEBOUNCE_SECONDS)
 
-def setup_channel_update_handlers(client) -> None:
     async def on_raw(event):
         update = event
         if isinstance(update, tl_types.UpdateChannel):
-            await _refresh_peer(client, tl_types.PeerChannel(update.channel_id))
+            buffer.add_peer(tl_types.PeerChannel(update.channel_id))
         elif isinstance(update, tl_types.UpdateChannelTooLong):
-            await _refresh_peer(client, tl_types.PeerChannel(update.channel_id))
+            buffer.add_peer(tl_types.PeerChannel(update.channel_id))
         elif isinstance(update, tl_types.UpdateChat):
-            await _refresh_peer(client, tl_types.PeerChat(update.chat_id), forced_kind="chat")
+            buffer.add_peer(tl_types.PeerChat(update.chat_id), forced_kind="chat")
 
     async def on_chat_action(event):
         if getattr(event, "new_title", None) or event.user_added or event.user_joined:
             chat = event.chat or await event.get_chat()
             forced_kind = "chat" if not event.is_channel else None
-            await _upsert_entity(chat, forced_kind=forced_kind)
+            buffer.add_entity(chat, forced_kind=forced_kind)
 
     client.add_event_handler(on_raw, events.Raw())
     client.add_event_handler(on_chat_action, events.ChatAction())
+    return buffer
@@ -6,23 +6,76 @@ import time
 from dotenv import load_dotenv
 from telethon.sync import TelegramClient
 
-logging.basicConfig(
-    level=logging.INFO,
-    # format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
-    format="%(levelname)s:%(name)s - %(message)s",
-)
+from service.logging_setup import setup_logging
+
+load_dotenv()
 
-data_directory = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+data_directory = os.getenv("DATA_DIRECTORY") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"
+)
 session = os.path.join(data_directory, 'channel_watcher.session')
 
-load_dotenv()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLED_PER_MINUTE = int(os.getenv("LOG_SAMPLED_PER_MINUTE", "0"))
+LOG_TEXT_LIMIT = int(os.getenv("LOG_TEXT_LIMIT", "200"))
 
+setup_logging(getattr(logging, LOG_LEVEL, logging.INFO), LOG_FORMAT, LOG_SAMPLED_PER_MINUTE)
+
+TELEGRAM_FAKE_CLIENT = os.getenv("TELEGRAM_FAKE_CLIENT", "").lower() in ("1", "true", "yes")
+TELEGRAM_FAKE_API_LATENCY = float(os.getenv("TELEGRAM_FAKE_API_LATENCY", "0.05"))
 TELEGRAM_RETRY_DELAY_SECONDS = float(os.getenv("TELEGRAM_RETRY_DELAY_SECONDS", "5"))
 TELEGRAM_NETWORK_CHECK_HOST = os.getenv("TELEGRAM_NETWORK_CHECK_HOST", "8.8.8.8")
 TELEGRAM_NETWORK_CHECK_PORT = int(os.getenv("TELEGRAM_NETWORK_CHECK_PORT", "53"))
 TELEGRAM_NETWORK_CHECK_TIMEOUT = float(os.getenv("TELEGRAM_NETWORK_CHECK_TIMEOUT", "3"))
 WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
 WEB_PORT = int(os.getenv("WEB_PORT", "8080"))
+NEAR_DUPLICATE_TTL_SECONDS = int(os.getenv("NEAR_DUPLICATE_TTL_SECONDS", str(60 * 60 * 12)))
+# Both limits compare 64-bit SimHash fingerprints: the distance is in differing bits and the threshold
+# is the share of equal bits, not of equal text (90 allows 64 * 10 % = 6 bits); see service/simhash.py
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "5"))
+BLOCKED_SIMILARITY_THRESHOLD = float(os.getenv("BLOCKED_SIMILARITY_THRESHOLD", "90"))
+FORWARD_INDEX_TTL_SECONDS = int(os.getenv("FORWARD_INDEX_TTL_SECONDS", str(60 * 60 * 12)))
+FORWARD_INDEX_MAX_SIZE = int(os.getenv("FORWARD_INDEX_MAX_SIZE", "50000"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_OVERFLOW_POLICY = os.getenv("INGEST_OVERFLOW_POLICY", "drop_oldest")
+# "<minimal chat priority>:<weight>" pairs, e.g. "1:4,0:1": chats with priority 1+ get 4 of every 5 workers' turns
+INGEST_LANES = [
+    (int(priority), int(weight))
+    for priority, weight in (
+        lane.split(":") for lane in os.getenv("INGEST_LANES", "1:4,0:1").split(",") if lane.strip()
+    )
+]
+DELIVERY_RATE_PER_SECOND = float(os.getenv("DELIVERY_RATE_PER_SECOND", "1"))
+DELIVERY_BURST = int(os.getenv("DELIVERY_BURST", "3"))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
+DELIVERY_QUEUE_SIZE = int(os.getenv("DELIVERY_QUEUE_SIZE", "1000"))
+READ_ACK_INTERVAL_SECONDS = float(os.getenv("READ_ACK_INTERVAL_SECONDS", "5"))
+NOTIFY_MODE = os.getenv("NOTIFY_MODE", "forward")
+EXCERPT_LENGTH = int(os.getenv("EXCERPT_LENGTH", "700"))
+DIGEST_WINDOW_SECONDS = float(os.getenv("DIGEST_WINDOW_SECONDS", "60"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "20"))
+MATCH_LOG_FLUSH_SECONDS = float(os.getenv("MATCH_LOG_FLUSH_SECONDS", "5"))
+MATCH_LOG_BATCH_SIZE = int(os.getenv("MATCH_LOG_BATCH_SIZE", "500"))
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "").lower() in ("1", "true", "yes")
+ARCHIVE_RETENTION_DAYS = float(os.getenv("ARCHIVE_RETENTION_DAYS", "14"))
+ARCHIVE_MAX_MESSAGES = int(os.getenv("ARCHIVE_MAX_MESSAGES", "200000"))
+ARCHIVE_SEARCH_CANDIDATES = int(os.getenv("ARCHIVE_SEARCH_CANDIDATES", "2000"))
+CHANNEL_SYNC_INTERVAL_SECONDS = float(os.getenv("CHANNEL_SYNC_INTERVAL_SECONDS", str(60 * 60 * 6)))
+CHANNEL_SYNC_JITTER = float(os.getenv("CHANNEL_SYNC_JITTER", "0.1"))
+CHANNEL_UPDATE_DEBOUNCE_SECONDS = float(os.getenv("CHANNEL_UPDATE_DEBOUNCE_SECONDS", "5"))
+INVITE_LINK_CONCURRENCY = int(os.getenv("INVITE_LINK_CONCURRENCY", "4"))
+INVITE_LINK_RETRY_HOURS = float(os.getenv("INVITE_LINK_RETRY_HOURS", "24"))
+BACKLOG_CONCURRENCY = int(os.getenv("BACKLOG_CONCURRENCY", "4"))
+BACKLOG_SLICE_SIZE = int(os.getenv("BACKLOG_SLICE_SIZE", "100"))
+BACKLOG_MAX_AGE_HOURS = float(os.getenv("BACKLOG_MAX_AGE_HOURS", "0"))
+BACKLOG_MAX_MESSAGES_PER_CHAT = int(os.getenv("BACKLOG_MAX_MESSAGES_PER_CHAT", "0"))
+PIPELINE_STAGES = [
+    stage.strip()
+    for stage in os.getenv("PIPELINE_STAGES", "reject,dedup,archive,prefilter,score,link,deliver").split(",")
+    if stage.strip()
+]
 
 
 def _wait_for_internet_connection(delay: float, host: str, port: int, timeout: float) -> None:
@@ -43,19 +96,25 @@ def _wait_for_internet_connection(delay: float, host: str, port: int, timeout: f
             time.sleep(delay)
 
 
-client = TelegramClient(
-    session,
-    int(os.getenv('TELEGRAM_APP_ID')),
-    os.getenv('TELEGRAM_API_HASH')
-)
-client.parse_mode = 'html'
-_wait_for_internet_connection(
-    TELEGRAM_RETRY_DELAY_SECONDS,
-    TELEGRAM_NETWORK_CHECK_HOST,
-    TELEGRAM_NETWORK_CHECK_PORT,
-    TELEGRAM_NETWORK_CHECK_TIMEOUT,
-)
-client.start()
+if TELEGRAM_FAKE_CLIENT:
+    from service.fake_client import FakeTelegramClient
+
+    client = FakeTelegramClient(api_latency=TELEGRAM_FAKE_API_LATENCY)
+    TARGET_USER = client.make_user(int(os.getenv('TARGET_USER') or 1))
+else:
+    client = TelegramClient(
+        session,
+        int(os.getenv('TELEGRAM_APP_ID')),
+        os.getenv('TELEGRAM_API_HASH')
+    )
+    client.parse_mode = 'html'
+    _wait_for_internet_connection(
+        TELEGRAM_RETRY_DELAY_SECONDS,
+        TELEGRAM_NETWORK_CHECK_HOST,
+        TELEGRAM_NETWORK_CHECK_PORT,
+        TELEGRAM_NETWORK_CHECK_TIMEOUT,
+    )
+    client.start()
 
-TARGET_USER = int(os.getenv('TARGET_USER'))
-TARGET_USER = client.get_entity(TARGET_USER)
+    TARGET_USER = int(os.getenv('TARGET_USER'))
+    TARGET_USER = client.get_entity(TARGET_USER)
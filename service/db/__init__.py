@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from .database import Database
-from .models import ChannelGroupRecord, ChannelRecord, QueryRecord
+from .models import NOTIFY_MODES, ChannelGroupRecord, ChannelRecord, MatchRecord, QueryRecord, QueryStatsRecord
 
 db = Database()
 
@@ -11,4 +11,7 @@ __all__ = [
     "ChannelGroupRecord",
     "ChannelRecord",
     "QueryRecord",
+    "QueryStatsRecord",
+    "MatchRecord",
+    "NOTIFY_MODES",
 ]
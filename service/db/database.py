@@ -1,16 +1,43 @@
 from __future__ import annotations
 
+import logging
+import re
 import sqlite3
 import threading
+import time
 from collections import defaultdict
 from importlib import resources
 from pathlib import Path
+from types import MappingProxyType
 from typing import Dict, Iterable, List, Sequence, Set, Tuple
 
 from service.bootstrap import bootstrap_from_legacy_files
-from service.config import data_directory
-from .models import ChannelGroupRecord, ChannelRecord, QueryRecord
+from service.config import (
+    ARCHIVE_ENABLED,
+    ARCHIVE_MAX_MESSAGES,
+    ARCHIVE_RETENTION_DAYS,
+    BLOCKED_SIMILARITY_THRESHOLD,
+    MATCH_LOG_BATCH_SIZE,
+    MATCH_LOG_FLUSH_SECONDS,
+    data_directory,
+)
+from service.metrics import Histogram
+from service.simhash import FINGERPRINT_VERSION, SimHashIndex, similarity_to_distance, text_fingerprint
+from .models import (
+    NOTIFY_MODES,
+    AssignmentSnapshot,
+    ChannelGroupRecord,
+    ChannelRecord,
+    MatchRecord,
+    QueryRecord,
+    QueryStatsRecord,
+)
 from .sql import *
+from .write_behind import WriteBehindBuffer
+
+ARCHIVE_PRUNE_INTERVAL_SECONDS = 60 * 10
+
+DB_CALL_SECONDS = Histogram("db_call_seconds", "Time spent in SQLite calls, lock wait included.", labels=("op",))
 
 
 class Database:
@@ -30,28 +57,51 @@ class Database:
         self._apply_migrations()
         self._bootstrap_from_legacy_files()
         self._reload_assignment_cache()
+        self._channels_by_id: Dict[int, ChannelRecord] = {}
+        self._reload_channel_cache()
+        self._chat_priorities: Dict[int, int] = {}
+        self._reload_priority_cache()
         self._blocked_hashes: Set[str] = set()
+        self._blocked_index = SimHashIndex(similarity_to_distance(BLOCKED_SIMILARITY_THRESHOLD))
         self._reload_blocked_messages_cache()
+        self._match_log: WriteBehindBuffer[tuple] = WriteBehindBuffer(
+            self._write_match_log, MATCH_LOG_FLUSH_SECONDS, MATCH_LOG_BATCH_SIZE
+        )
+        self._checkpoints: Dict[int, int] = {
+            row["chat_id"]: row["message_id"]
+            for row in self._fetchall("SELECT chat_id, message_id FROM chat_checkpoints")
+        }
+        self._resume_points: Dict[int, int] = dict(self._checkpoints)
+        self._saved_checkpoints: Dict[int, int] = dict(self._checkpoints)
+        self._checkpoint_holds: Dict[int, Dict[str, int]] = defaultdict(dict)
+        self._checkpoint_log: WriteBehindBuffer[Tuple[int, int]] = WriteBehindBuffer(
+            self._write_checkpoints, MATCH_LOG_FLUSH_SECONDS, MATCH_LOG_BATCH_SIZE
+        )
+        self.archive_enabled = ARCHIVE_ENABLED and self._ensure_archive()
+        self._archive_pruned_at = 0.0
+        self._archive_log: WriteBehindBuffer[tuple] = WriteBehindBuffer(
+            self._write_archive, MATCH_LOG_FLUSH_SECONDS, MATCH_LOG_BATCH_SIZE
+        )
 
     # region helpers -----------------------------------------------------
     def _execute(self, sql: str, params: Sequence | Tuple = ()) -> sqlite3.Cursor:
-        with self._lock:
+        with DB_CALL_SECONDS.time(op="execute"), self._lock:
             cur = self._conn.execute(sql, params)
             self._conn.commit()
             return cur
 
     def _executemany(self, sql: str, rows: Iterable[Sequence]) -> sqlite3.Cursor:
-        with self._lock:
+        with DB_CALL_SECONDS.time(op="executemany"), self._lock:
             cur = self._conn.executemany(sql, rows)
             self._conn.commit()
             return cur
 
     def _fetchall(self, sql: str, params: Sequence | Tuple = ()) -> List[sqlite3.Row]:
-        with self._lock:
+        with DB_CALL_SECONDS.time(op="fetchall"), self._lock:
             return self._conn.execute(sql, params).fetchall()
 
     def _fetchone(self, sql: str, params: Sequence | Tuple = ()) -> sqlite3.Row | None:
-        with self._lock:
+        with DB_CALL_SECONDS.time(op="fetchone"), self._lock:
             return self._conn.execute(sql, params).fetchone()
 
     @staticmethod
@@ -97,6 +147,26 @@ class Database:
             self._refresh_channel_relationship_tables()
         if not self._table_exists("blocked_messages"):
             self._create_blocked_messages_table()
+        if not self._column_exists("blocked_messages", "fingerprint"):
+            self._execute("ALTER TABLE blocked_messages ADD COLUMN fingerprint TEXT")
+        if self.get_metadata("fingerprint_version") != str(FINGERPRINT_VERSION):
+            # Fingerprints of another algorithm are not comparable, the cache reload recomputes them from samples
+            self._execute("UPDATE blocked_messages SET fingerprint = NULL")
+            self.set_metadata("fingerprint_version", str(FINGERPRINT_VERSION))
+        if not self._column_exists("queries", "notify_mode"):
+            self._execute("ALTER TABLE queries ADD COLUMN notify_mode TEXT")
+        if not self._table_exists("matches"):
+            self._execute(SQL_CREATE_MATCHES_TABLE)
+            self._execute(SQL_CREATE_MATCHES_INDEX)
+        if not self._table_exists("query_stats"):
+            self._execute(SQL_CREATE_QUERY_STATS_TABLE)
+        if not self._table_exists("chat_checkpoints"):
+            self._execute(SQL_CREATE_CHAT_CHECKPOINTS_TABLE)
+        if not self._table_exists("invite_link_failures"):
+            self._execute(SQL_CREATE_INVITE_LINK_FAILURES_TABLE)
+        for table in ("channels", "channel_groups"):
+            if not self._column_exists(table, "priority"):
+                self._execute(f"ALTER TABLE {table} ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
 
     def _column_exists(self, table: str, column: str) -> bool:
         rows = self._fetchall(f"PRAGMA table_info({table})")
@@ -149,12 +219,23 @@ class Database:
                 CREATE TABLE IF NOT EXISTS blocked_messages (
                     hash TEXT PRIMARY KEY,
                     sample TEXT NOT NULL,
+                    fingerprint TEXT,
                     created_at TEXT DEFAULT CURRENT_TIMESTAMP
                 )
                 """
             )
             self._conn.commit()
 
+    def _ensure_archive(self) -> bool:
+        try:
+            with self._lock:
+                self._conn.executescript(SQL_CREATE_ARCHIVE)
+                self._conn.commit()
+        except sqlite3.OperationalError as exc:
+            logging.warning("Message archive disabled, SQLite has no FTS5 support: %s", exc)
+            return False
+        return True
+
     def _remove_last_seen_column(self) -> None:
         with self._lock:
             self._conn.execute("PRAGMA foreign_keys=OFF;")
@@ -169,37 +250,57 @@ class Database:
                 self._conn.commit()
 
     # region query operations -------------------------------------------
+    @staticmethod
+    def _query_from_row(row: sqlite3.Row) -> QueryRecord:
+        return QueryRecord(
+            id=row["id"],
+            phrase=row["phrase"],
+            channel_count=row["channel_count"],
+            notify_mode=row["notify_mode"],
+        )
+
     def list_queries(self) -> List[QueryRecord]:
         rows = self._fetchall(SQL_LIST_QUERIES)
-        return [QueryRecord(id=row["id"], phrase=row["phrase"], channel_count=row["channel_count"]) for row in rows]
+        return [self._query_from_row(row) for row in rows]
 
     def add_query(self, phrase: str) -> int:
         cleaned = (phrase or "").strip()
         if not cleaned:
             raise ValueError("Query text can not be empty")
         cur = self._execute("INSERT INTO queries (phrase) VALUES (?)", (cleaned,))
-        return int(cur.lastrowid)
+        query_id = int(cur.lastrowid)
+        self._update_assignments(query_ids=[query_id])
+        return query_id
 
-    def update_query(self, query_id: int, phrase: str) -> None:
+    def update_query(self, query_id: int, phrase: str, notify_mode: str | None = None) -> None:
         cleaned = (phrase or "").strip()
         if not cleaned:
             raise ValueError("Query text can not be empty")
-        cur = self._execute("UPDATE queries SET phrase = ? WHERE id = ?", (cleaned, query_id))
+        notify_mode = (notify_mode or "").strip() or None
+        if notify_mode and notify_mode not in NOTIFY_MODES:
+            raise ValueError(f"Unknown notify mode: {notify_mode}")
+        cur = self._execute(
+            "UPDATE queries SET phrase = ?, notify_mode = ? WHERE id = ?",
+            (cleaned, notify_mode, query_id),
+        )
         if cur.rowcount == 0:
             raise ValueError(f"Query {query_id} not found")
-        self._reload_assignment_cache()
+        self._update_assignments(self.get_channel_ids_for_query(query_id), [query_id])
 
     def delete_query(self, query_id: int) -> None:
+        channel_ids = self.get_channel_ids_for_query(query_id)
         self._execute("DELETE FROM channel_queries WHERE query_id = ?", (query_id,))
+        self._execute("DELETE FROM matches WHERE query_id = ?", (query_id,))
+        self._execute("DELETE FROM query_stats WHERE query_id = ?", (query_id,))
         cur = self._execute("DELETE FROM queries WHERE id = ?", (query_id,))
         if cur.rowcount:
-            self._reload_assignment_cache()
+            self._update_assignments(channel_ids, [query_id])
 
     def get_query(self, query_id: int) -> QueryRecord | None:
         row = self._fetchone(SQL_GET_QUERY, (query_id,))
         if not row:
             return None
-        return QueryRecord(id=row["id"], phrase=row["phrase"], channel_count=row["channel_count"])
+        return self._query_from_row(row)
 
     def get_channel_ids_for_query(self, query_id: int) -> List[int]:
         rows = self._fetchall(SQL_CHANNEL_IDS_FOR_QUERY, (query_id,))
@@ -207,40 +308,34 @@ class Database:
 
     def set_query_channels(self, query_id: int, channel_ids: Sequence[int]) -> None:
         unique_ids = self._normalize_ids(channel_ids)
+        previous_ids = self.get_channel_ids_for_query(query_id)
         self._execute("DELETE FROM channel_queries WHERE query_id = ?", (query_id,))
         if unique_ids:
             self._executemany(
                 "INSERT INTO channel_queries (channel_id, query_id) VALUES (?, ?)",
                 ((cid, query_id) for cid in unique_ids),
             )
-        self._reload_assignment_cache()
+        self._update_assignments(set(previous_ids) ^ set(unique_ids))
 
     # region channel operations -----------------------------------------
-    def list_channels(self) -> List[ChannelRecord]:
-        rows = self._fetchall(SQL_LIST_CHANNELS)
-        return [
-            ChannelRecord(
-                id=row["id"],
-                title=row["title"] or f"Chat {row['id']}",
-                invite_link=row["invite_link"],
-                username=row["username"],
-                kind=row["kind"],
-            )
-            for row in rows
-        ]
-
-    def get_channel(self, channel_id: int) -> ChannelRecord | None:
-        row = self._fetchone(SQL_GET_CHANNEL, (channel_id,))
-        if not row:
-            return None
+    @staticmethod
+    def _channel_from_row(row: sqlite3.Row) -> ChannelRecord:
         return ChannelRecord(
             id=row["id"],
             title=row["title"] or f"Chat {row['id']}",
             invite_link=row["invite_link"],
             username=row["username"],
             kind=row["kind"],
+            priority=row["priority"],
         )
 
+    def list_channels(self) -> List[ChannelRecord]:
+        rows = self._fetchall(SQL_LIST_CHANNELS)
+        return [self._channel_from_row(row) for row in rows]
+
+    def get_channel(self, channel_id: int) -> ChannelRecord | None:
+        return self._channels_by_id.get(channel_id)
+
     def upsert_channels(self, entries: Iterable[ChannelRecord]) -> int:
         payload = []
         for entry in entries:
@@ -256,10 +351,25 @@ class Database:
         if not payload:
             return 0
         self._executemany(SQL_UPSERT_CHANNELS, payload)
+        for item in payload:
+            cached = self._channels_by_id.get(item["id"])
+            self._channels_by_id[item["id"]] = ChannelRecord(
+                id=item["id"],
+                title=item["title"] or f"Chat {item['id']}",
+                invite_link=item["invite_link"],
+                username=item["username"],
+                kind=item["kind"],
+                priority=cached.priority if cached else 0,
+            )
         return len(payload)
 
     def delete_channels_by_kind(self, kind: str) -> int:
+        channel_ids = [row["id"] for row in self._fetchall("SELECT id FROM channels WHERE kind = ?", (kind,))]
         cur = self._execute("DELETE FROM channels WHERE kind = ?", (kind,))
+        if cur.rowcount:
+            self._reload_channel_cache()
+            self._reload_priority_cache()
+            self._update_assignments(channel_ids)
         return cur.rowcount
 
     def delete_channels(self, channel_ids: Sequence[int]) -> int:
@@ -269,9 +379,54 @@ class Database:
         placeholders = ",".join("?" for _ in normalized)
         cur = self._execute(f"DELETE FROM channels WHERE id IN ({placeholders})", normalized)
         if cur.rowcount:
-            self._reload_assignment_cache()
+            for channel_id in normalized:
+                self._channels_by_id.pop(channel_id, None)
+            self._update_assignments(normalized)
+            self._reload_priority_cache()
         return cur.rowcount
 
+    def _reload_channel_cache(self) -> None:
+        rows = self._fetchall(SQL_LIST_CHANNELS)
+        self._channels_by_id = {row["id"]: self._channel_from_row(row) for row in rows}
+
+    def set_channel_priority(self, channel_id: int, priority: int) -> None:
+        cur = self._execute("UPDATE channels SET priority = ? WHERE id = ?", (int(priority), channel_id))
+        if cur.rowcount == 0:
+            raise ValueError(f"Канал {channel_id} не найден")
+        self._reload_channel_cache()
+        self._reload_priority_cache()
+
+    def _reload_priority_cache(self) -> None:
+        self._chat_priorities = {
+            row["chat_id"]: row["priority"] for row in self._fetchall(SQL_CHAT_PRIORITIES) if row["priority"]
+        }
+
+    def get_chat_priority(self, chat_id: int) -> int:
+        """Returns the priority of the chat: its own or the highest of its groups, whichever is greater."""
+        return self._chat_priorities.get(chat_id, 0)
+
+    def get_recent_invite_link_failures(self, ttl_seconds: float) -> Set[int]:
+        """Returns ids of chats whose invite link export failed less than ``ttl_seconds`` ago."""
+        rows = self._fetchall(
+            "SELECT chat_id FROM invite_link_failures WHERE failed_at > ?",
+            (time.time() - ttl_seconds,),
+        )
+        return {row["chat_id"] for row in rows}
+
+    def record_invite_link_failures(self, failures: Dict[int, str]) -> None:
+        if failures:
+            now = time.time()
+            self._executemany(
+                SQL_UPSERT_INVITE_LINK_FAILURE,
+                ((chat_id, reason, now) for chat_id, reason in failures.items()),
+            )
+
+    def clear_invite_link_failures(self, chat_ids: Sequence[int]) -> None:
+        normalized = self._normalize_ids(chat_ids)
+        if normalized:
+            placeholders = ",".join("?" for _ in normalized)
+            self._execute(f"DELETE FROM invite_link_failures WHERE chat_id IN ({placeholders})", normalized)
+
     def get_query_ids_for_channel(self, channel_id: int) -> List[int]:
         rows = self._fetchall(SQL_QUERY_IDS_FOR_CHANNEL, (channel_id,))
         return [row["query_id"] for row in rows]
@@ -284,7 +439,7 @@ class Database:
                 "INSERT INTO channel_queries (channel_id, query_id) VALUES (?, ?)",
                 ((channel_id, qid) for qid in normalized),
             )
-        self._reload_assignment_cache()
+        self._update_assignments([channel_id])
 
     # region groups ------------------------------------------------------
     def list_channel_groups(self) -> List[ChannelGroupRecord]:
@@ -295,6 +450,7 @@ class Database:
                 title=row["title"],
                 description=row["description"],
                 channel_count=row["channel_count"],
+                priority=row["priority"],
             )
             for row in rows
         ]
@@ -308,6 +464,7 @@ class Database:
             title=row["title"],
             description=row["description"],
             channel_count=row["channel_count"],
+            priority=row["priority"],
         )
 
     def add_channel_group(self, title: str, description: str | None = None) -> int:
@@ -320,19 +477,23 @@ class Database:
         )
         return int(cur.lastrowid)
 
-    def update_channel_group(self, group_id: int, title: str, description: str | None = None) -> None:
+    def update_channel_group(
+        self, group_id: int, title: str, description: str | None = None, priority: int = 0
+    ) -> None:
         cleaned = (title or "").strip()
         if not cleaned:
             raise ValueError("Название группы не может быть пустым")
         cur = self._execute(
-            "UPDATE channel_groups SET title = ?, description = ? WHERE id = ?",
-            (cleaned, (description or "").strip() or None, group_id),
+            "UPDATE channel_groups SET title = ?, description = ?, priority = ? WHERE id = ?",
+            (cleaned, (description or "").strip() or None, int(priority), group_id),
         )
         if cur.rowcount == 0:
             raise ValueError(f"Группа {group_id} не найдена")
+        self._reload_priority_cache()
 
     def delete_channel_group(self, group_id: int) -> None:
         self._execute("DELETE FROM channel_groups WHERE id = ?", (group_id,))
+        self._reload_priority_cache()
 
     def get_channel_ids_for_group(self, group_id: int) -> List[int]:
         rows = self._fetchall(SQL_GROUP_CHANNEL_IDS, (group_id,))
@@ -346,6 +507,7 @@ class Database:
                 "INSERT INTO channel_group_members (group_id, channel_id) VALUES (?, ?)",
                 ((group_id, channel_id) for channel_id in normalized),
             )
+        self._reload_priority_cache()
 
     def get_all_group_memberships(self) -> Dict[int, List[int]]:
         rows = self._fetchall(
@@ -364,6 +526,7 @@ class Database:
                 title=row["title"],
                 description=row["description"],
                 channel_count=row["channel_count"],
+                priority=row["priority"],
             )
             for row in rows
         ]
@@ -412,7 +575,7 @@ class Database:
                 "DELETE FROM channel_queries WHERE channel_id = ? AND query_id = ?",
                 to_remove,
             )
-        self._reload_assignment_cache()
+        self._update_assignments({channel_id for channel_id, _ in to_add + to_remove})
 
     # region metadata + cache -------------------------------------------
     def set_metadata(self, key: str, value: str) -> None:
@@ -427,28 +590,39 @@ class Database:
 
     # region blocked messages ------------------------------------------
     def _reload_blocked_messages_cache(self) -> None:
-        rows = self._fetchall("SELECT hash FROM blocked_messages")
+        rows = self._fetchall("SELECT hash, sample, fingerprint FROM blocked_messages")
         self._blocked_hashes = {row["hash"] for row in rows}
+        self._blocked_index.clear()
+        for row in rows:
+            # Rows stored before the fingerprint column only have the sample to fall back to
+            fingerprint = int(row["fingerprint"], 16) if row["fingerprint"] else text_fingerprint(row["sample"])
+            if fingerprint is not None:
+                self._blocked_index.add(row["hash"], fingerprint)
 
-    def is_message_blocked(self, message_hash: str) -> bool:
-        return message_hash in self._blocked_hashes
+    def is_message_blocked(self, message_hash: str, fingerprint: int | None = None) -> bool:
+        if message_hash in self._blocked_hashes:
+            return True
+        return fingerprint is not None and self._blocked_index.find(fingerprint) is not None
 
     def add_blocked_message(self, message_hash: str, sample: str) -> bool:
         cleaned = (sample or "").strip()
         if not cleaned:
             raise ValueError("Нельзя заблокировать пустой текст")
-        truncated = cleaned[:2048]
+        # Incoming messages are fingerprinted on their full text, so is the template; only the sample is cut
+        fingerprint = text_fingerprint(cleaned)
         cur = self._execute(
             """
-            INSERT INTO blocked_messages (hash, sample)
-            VALUES (?, ?)
+            INSERT INTO blocked_messages (hash, sample, fingerprint)
+            VALUES (?, ?, ?)
             ON CONFLICT(hash) DO NOTHING
             """,
-            (message_hash, truncated),
+            (message_hash, cleaned[:2048], format(fingerprint, "016x") if fingerprint is not None else None),
         )
         created = cur.rowcount > 0
         if created:
             self._blocked_hashes.add(message_hash)
+            if fingerprint is not None:
+                self._blocked_index.add(message_hash, fingerprint)
         return created
 
     def remove_blocked_message(self, message_hash: str) -> bool:
@@ -456,6 +630,7 @@ class Database:
         removed = cur.rowcount > 0
         if removed:
             self._blocked_hashes.discard(message_hash)
+            self._blocked_index.discard(message_hash)
         return removed
 
     def list_blocked_messages(self, limit: int = 100) -> List[Dict[str, str]]:
@@ -473,18 +648,269 @@ class Database:
             for row in rows
         ]
 
-    def _reload_assignment_cache(self) -> None:
+    # region match history --------------------------------------------
+    def record_evaluations(
+        self,
+        chat_id: int,
+        message_id: int,
+        evaluations: Sequence[Tuple[int, float | None, float]],
+        processing_seconds: float,
+    ) -> None:
+        """
+        Queues the scoring results of one message for the background writer.
+
+        Args:
+            chat_id (int): The chat the message came from.
+            message_id (int): The message id.
+            evaluations (Sequence[Tuple[int, float | None, float]]): (query id, score or None
+                when the query did not match, seconds spent scoring) for every evaluated query.
+            processing_seconds (float): Time from receiving the message until it was scored.
+        """
+        self._match_log.add((chat_id, message_id, tuple(evaluations), processing_seconds))
+
+    def flush_pending_writes(self) -> int:
+        return self._match_log.flush() + self._archive_log.flush() + self._checkpoint_log.flush()
+
+    def _write_match_log(self, batch: List[tuple]) -> None:
+        matches = []
+        stats: Dict[int, Dict[str, float]] = {}
+        for chat_id, message_id, evaluations, processing_seconds in batch:
+            for query_id, score, seconds in evaluations:
+                item = stats.setdefault(
+                    query_id,
+                    {"query_id": query_id, "evaluations": 0, "matches": 0, "score_seconds": 0.0},
+                )
+                item["evaluations"] += 1
+                item["score_seconds"] += seconds
+                if score is not None:
+                    item["matches"] += 1
+                    matches.append((chat_id, message_id, query_id, score, seconds * 1000, processing_seconds * 1000))
+        with DB_CALL_SECONDS.time(op="write_behind"), self._lock:
+            try:
+                self._conn.executemany(SQL_INSERT_MATCH, matches)
+                self._conn.executemany(SQL_UPSERT_QUERY_STATS, list(stats.values()))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def get_query_stats(self) -> Dict[int, QueryStatsRecord]:
+        rows = self._fetchall(SQL_QUERY_STATS)
+        return {
+            row["query_id"]: QueryStatsRecord(
+                query_id=row["query_id"],
+                evaluations=row["evaluations"],
+                matches=row["matches"],
+                score_seconds=row["score_seconds"],
+                last_match_at=row["last_match_at"],
+            )
+            for row in rows
+        }
+
+    def list_recent_matches(self, query_id: int, limit: int = 50) -> List[MatchRecord]:
+        rows = self._fetchall(SQL_RECENT_MATCHES_FOR_QUERY, (query_id, max(1, limit)))
+        return [
+            MatchRecord(
+                chat_id=row["chat_id"],
+                message_id=row["message_id"],
+                score=row["score"],
+                score_ms=row["score_ms"],
+                processing_ms=row["processing_ms"],
+                created_at=row["created_at"],
+                chat_title=row["title"],
+                chat_username=row["username"],
+            )
+            for row in rows
+        ]
+
+    # region chat checkpoints -----------------------------------------
+    def get_checkpoint(self, chat_id: int) -> int:
+        """Returns the id of the last evaluated message of the chat, 0 if none."""
+        return self._checkpoints.get(chat_id, 0)
+
+    def get_resume_point(self, chat_id: int) -> int:
+        """Returns the checkpoint the chat had when the service started."""
+        return self._resume_points.get(chat_id, 0)
+
+    def advance_checkpoint(self, chat_id: int, message_id: int) -> None:
+        if message_id > self._checkpoints.get(chat_id, 0):
+            self._checkpoints[chat_id] = message_id
+            self._save_checkpoint(chat_id)
+
+    def hold_checkpoint(self, chat_id: int, message_id: int, reason: str) -> None:
+        """
+        Keeps the stored checkpoint of the chat at or below ``message_id`` until the hold is released.
+
+        Messages above the hold may already be evaluated, but a restart resumes from the hold,
+        so nothing below it that is still pending gets lost. Holds of different reasons combine.
+        """
+        self._checkpoint_holds[chat_id][reason] = message_id
+        self._save_checkpoint(chat_id)
+
+    def release_checkpoint(self, chat_id: int, reason: str) -> None:
+        holds = self._checkpoint_holds.get(chat_id)
+        if holds and holds.pop(reason, None) is not None:
+            if not holds:
+                del self._checkpoint_holds[chat_id]
+            self._save_checkpoint(chat_id)
+
+    def _save_checkpoint(self, chat_id: int) -> None:
+        holds = self._checkpoint_holds.get(chat_id)
+        message_id = self._checkpoints.get(chat_id, 0)
+        if holds:
+            message_id = min(message_id, *holds.values())
+        if message_id > self._saved_checkpoints.get(chat_id, 0):
+            self._saved_checkpoints[chat_id] = message_id
+            self._checkpoint_log.add((chat_id, message_id))
+
+    def _write_checkpoints(self, batch: List[Tuple[int, int]]) -> None:
+        latest: Dict[int, int] = {}
+        for chat_id, message_id in batch:
+            latest[chat_id] = max(message_id, latest.get(chat_id, 0))
+        self._executemany(SQL_UPSERT_CHAT_CHECKPOINT, latest.items())
+
+    # region message archive ------------------------------------------
+    def archive_message(self, chat_id: int, message_id: int, text: str) -> None:
+        if self.archive_enabled and text:
+            self._archive_log.add((chat_id, message_id, text))
+
+    def _write_archive(self, batch: List[tuple]) -> None:
+        with DB_CALL_SECONDS.time(op="write_behind"), self._lock:
+            try:
+                self._conn.executemany(SQL_INSERT_ARCHIVE_MESSAGE, batch)
+                if time.monotonic() - self._archive_pruned_at >= ARCHIVE_PRUNE_INTERVAL_SECONDS:
+                    self._conn.execute(SQL_PRUNE_ARCHIVE_BY_AGE, (f"-{ARCHIVE_RETENTION_DAYS} days",))
+                    self._conn.execute(SQL_PRUNE_ARCHIVE_BY_SIZE, (ARCHIVE_MAX_MESSAGES,))
+                    self._archive_pruned_at = time.monotonic()
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    @staticmethod
+    def _archive_match_expression(phrase: str) -> str:
+        """
+        Builds an FTS5 expression that finds texts sharing any word stem with the phrase.
+
+        Word endings are cut off, so inflected forms are retrieved too. The result only narrows
+        down the candidates, the actual matching is done by the search engine.
+        """
+        terms = []
+        for word in re.findall(r"\w+", phrase.lower()):
+            if len(word) < 3:
+                continue
+            stem = word[:max(3, len(word) - 2)]
+            term = f'"{stem}"*'
+            if term not in terms:
+                terms.append(term)
+        return " OR ".join(terms)
+
+    def search_archive(self, phrase: str, limit: int) -> List[Dict[str, object]]:
+        """Returns archived messages that may match the phrase, best FTS5 ranks first."""
+        if not self.archive_enabled:
+            return []
+        expression = self._archive_match_expression(phrase)
+        if not expression:
+            return []
+        rows = self._fetchall(SQL_SEARCH_ARCHIVE, (expression, max(1, limit)))
+        return [
+            {
+                "chat_id": row["chat_id"],
+                "message_id": row["message_id"],
+                "text": row["text"],
+                "created_at": row["created_at"],
+                "chat_title": row["title"],
+                "chat_username": row["username"],
+            }
+            for row in rows
+        ]
+
+    def get_archive_size(self) -> int:
+        if not self.archive_enabled:
+            return 0
+        row = self._fetchone("SELECT COUNT(*) AS cnt FROM archive_messages")
+        return row["cnt"] if row else 0
+
+    @staticmethod
+    def _group_assignments(rows: Iterable[sqlite3.Row]) -> Dict[int, Tuple[str, ...]]:
         mapping: Dict[int, List[str]] = defaultdict(list)
-        rows = self._fetchall(SQL_ASSIGNMENTS_FOR_CACHE)
         for row in rows:
             mapping[row["channel_id"]].append(row["phrase"])
-        self._queries_by_chat: Dict[int, Tuple[str, ...]] = {
-            chat_id: tuple(phrases) for chat_id, phrases in mapping.items()
-        }
-        self._tracked_chats = set(self._queries_by_chat.keys())
+        return {chat_id: tuple(phrases) for chat_id, phrases in mapping.items()}
+
+    def _publish_assignments(
+        self,
+        queries_by_chat: Dict[int, Tuple[str, ...]],
+        phrases: Dict[int, str],
+        notify_modes: Dict[str, str],
+    ) -> None:
+        previous = getattr(self, "_assignments", None)
+        # Readers take the snapshot with a single attribute read, so the swap is atomic for them
+        self._assignments = AssignmentSnapshot(
+            version=previous.version + 1 if previous else 1,
+            queries_by_chat=MappingProxyType(queries_by_chat),
+            phrases=MappingProxyType(phrases),
+            query_ids=MappingProxyType({phrase: query_id for query_id, phrase in phrases.items()}),
+            notify_modes=MappingProxyType(notify_modes),
+        )
+
+    def _reload_assignment_cache(self) -> None:
+        with self._lock:
+            settings = self._fetchall(SQL_QUERY_SETTINGS)
+            self._publish_assignments(
+                self._group_assignments(self._fetchall(SQL_ASSIGNMENTS_FOR_CACHE)),
+                {row["id"]: row["phrase"] for row in settings},
+                {row["phrase"]: row["notify_mode"] for row in settings if row["notify_mode"]},
+            )
+
+    def _update_assignments(self, channel_ids: Iterable[int] = (), query_ids: Iterable[int] = ()) -> None:
+        """
+        Publishes a new assignment snapshot with only the given chats and queries re-read.
+
+        Args:
+            channel_ids: chats whose assigned queries changed.
+            query_ids: queries that were added, renamed, deleted or got another notify mode.
+        """
+        channel_ids = self._normalize_ids(list(channel_ids))
+        query_ids = self._normalize_ids(list(query_ids))
+        if not channel_ids and not query_ids:
+            return
+        with self._lock:
+            current = self._assignments
+            queries_by_chat = dict(current.queries_by_chat)
+            phrases = dict(current.phrases)
+            notify_modes = dict(current.notify_modes)
+            if query_ids:
+                placeholders = ",".join("?" for _ in query_ids)
+                settings = self._fetchall(SQL_QUERY_SETTINGS_FOR_IDS.format(placeholders=placeholders), query_ids)
+                for query_id in query_ids:
+                    notify_modes.pop(phrases.pop(query_id, None), None)
+                for row in settings:
+                    phrases[row["id"]] = row["phrase"]
+                    if row["notify_mode"]:
+                        notify_modes[row["phrase"]] = row["notify_mode"]
+            if channel_ids:
+                placeholders = ",".join("?" for _ in channel_ids)
+                rows = self._fetchall(SQL_ASSIGNMENTS_FOR_CHANNELS.format(placeholders=placeholders), channel_ids)
+                for channel_id in channel_ids:
+                    queries_by_chat.pop(channel_id, None)
+                queries_by_chat.update(self._group_assignments(rows))
+            self._publish_assignments(queries_by_chat, phrases, notify_modes)
 
     def get_queries_for_chat(self, chat_id: int) -> Tuple[str, ...]:
-        return self._queries_by_chat.get(chat_id, tuple())
+        return self._assignments.queries_by_chat.get(chat_id, tuple())
+
+    def get_blocked_index_size(self) -> int:
+        return len(self._blocked_index)
+
+    def get_channel_cache_size(self) -> int:
+        return len(self._channels_by_id)
+
+    def get_query_notify_mode(self, phrase: str) -> str | None:
+        return self._assignments.notify_modes.get(phrase)
+
+    def get_query_id(self, phrase: str) -> int | None:
+        return self._assignments.query_ids.get(phrase)
 
     def get_tracked_chat_ids(self) -> Tuple[int, ...]:
-        return tuple(self._tracked_chats)
+        return tuple(self._assignments.queries_by_chat)
@@ -1,6 +1,10 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import Mapping, Tuple
+
+# Ordered by precedence: when matched queries disagree, the first mode wins
+NOTIFY_MODES = ("forward", "single", "digest")
 
 
 @dataclass(frozen=True)
@@ -8,6 +12,7 @@ class QueryRecord:
     id: int
     phrase: str
     channel_count: int = 0
+    notify_mode: str | None = None
 
 
 @dataclass(frozen=True)
@@ -17,6 +22,7 @@ class ChannelRecord:
     invite_link: str | None
     username: str | None
     kind: str | None = None
+    priority: int = 0
 
 
 @dataclass(frozen=True)
@@ -25,3 +31,44 @@ class ChannelGroupRecord:
     title: str
     description: str | None = None
     channel_count: int = 0
+    priority: int = 0
+
+
+@dataclass(frozen=True)
+class QueryStatsRecord:
+    query_id: int
+    evaluations: int = 0
+    matches: int = 0
+    score_seconds: float = 0.0
+    last_match_at: str | None = None
+
+    @property
+    def hit_rate(self) -> float:
+        return 100 * self.matches / self.evaluations if self.evaluations else 0.0
+
+    @property
+    def average_ms(self) -> float:
+        return 1000 * self.score_seconds / self.evaluations if self.evaluations else 0.0
+
+
+@dataclass(frozen=True)
+class MatchRecord:
+    chat_id: int
+    message_id: int
+    score: float
+    score_ms: float | None
+    processing_ms: float | None
+    created_at: str
+    chat_title: str | None = None
+    chat_username: str | None = None
+
+
+@dataclass(frozen=True)
+class AssignmentSnapshot:
+    """Query assignments as the message handlers see them; replaced as a whole on every change."""
+
+    version: int
+    queries_by_chat: Mapping[int, Tuple[str, ...]]
+    phrases: Mapping[int, str]
+    query_ids: Mapping[str, int]
+    notify_modes: Mapping[str, str]
@@ -4,6 +4,7 @@ PRAGMA foreign_keys = ON;
 CREATE TABLE IF NOT EXISTS queries (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     phrase TEXT NOT NULL,
+    notify_mode TEXT,
     created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -12,7 +13,8 @@ CREATE TABLE IF NOT EXISTS channels (
     title TEXT,
     invite_link TEXT,
     username TEXT,
-    kind TEXT
+    kind TEXT,
+    priority INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS channel_queries (
@@ -26,7 +28,8 @@ CREATE TABLE IF NOT EXISTS channel_queries (
 CREATE TABLE IF NOT EXISTS channel_groups (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     title TEXT NOT NULL,
-    description TEXT
+    description TEXT,
+    priority INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE IF NOT EXISTS channel_group_members (
@@ -45,5 +48,39 @@ CREATE TABLE IF NOT EXISTS metadata (
 CREATE TABLE IF NOT EXISTS blocked_messages (
     hash TEXT PRIMARY KEY,
     sample TEXT NOT NULL,
+    fingerprint TEXT,
     created_at TEXT DEFAULT CURRENT_TIMESTAMP
 );
+
+CREATE TABLE IF NOT EXISTS matches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    query_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    score_ms REAL,
+    processing_ms REAL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_matches_query ON matches (query_id, created_at);
+
+CREATE TABLE IF NOT EXISTS query_stats (
+    query_id INTEGER PRIMARY KEY,
+    evaluations INTEGER NOT NULL DEFAULT 0,
+    matches INTEGER NOT NULL DEFAULT 0,
+    score_seconds REAL NOT NULL DEFAULT 0,
+    last_match_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS chat_checkpoints (
+    chat_id INTEGER PRIMARY KEY,
+    message_id INTEGER NOT NULL,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS invite_link_failures (
+    chat_id INTEGER PRIMARY KEY,
+    reason TEXT,
+    failed_at REAL NOT NULL
+);
@@ -1,5 +1,5 @@
 SQL_LIST_QUERIES = """
-    SELECT q.id, q.phrase, COUNT(cq.channel_id) AS channel_count
+    SELECT q.id, q.phrase, q.notify_mode, COUNT(cq.channel_id) AS channel_count
     FROM queries q
     LEFT JOIN channel_queries cq ON cq.query_id = q.id
     GROUP BY q.id
@@ -7,7 +7,7 @@ SQL_LIST_QUERIES = """
 """
 
 SQL_GET_QUERY = """
-    SELECT q.id, q.phrase, COUNT(cq.channel_id) AS channel_count
+    SELECT q.id, q.phrase, q.notify_mode, COUNT(cq.channel_id) AS channel_count
     FROM queries q
     LEFT JOIN channel_queries cq ON cq.query_id = q.id
     WHERE q.id = ?
@@ -22,7 +22,7 @@ SQL_CHANNEL_IDS_FOR_QUERY = """
 """
 
 SQL_LIST_CHANNELS = """
-    SELECT id, title, invite_link, username, kind
+    SELECT id, title, invite_link, username, kind, priority
     FROM channels
     ORDER BY COALESCE(NULLIF(title, ''), CAST(id AS TEXT)) COLLATE NOCASE
 """
@@ -37,12 +37,6 @@ SQL_UPSERT_CHANNELS = """
         kind = excluded.kind
 """
 
-SQL_GET_CHANNEL = """
-    SELECT id, title, invite_link, username, kind
-    FROM channels
-    WHERE id = ?
-"""
-
 SQL_QUERY_IDS_FOR_CHANNEL = """
     SELECT query_id
     FROM channel_queries
@@ -51,7 +45,7 @@ SQL_QUERY_IDS_FOR_CHANNEL = """
 """
 
 SQL_LIST_GROUPS = """
-    SELECT g.id, g.title, g.description, COUNT(m.channel_id) AS channel_count
+    SELECT g.id, g.title, g.description, g.priority, COUNT(m.channel_id) AS channel_count
     FROM channel_groups g
     LEFT JOIN channel_group_members m ON m.group_id = g.id
     GROUP BY g.id
@@ -59,7 +53,7 @@ SQL_LIST_GROUPS = """
 """
 
 SQL_GET_GROUP = """
-    SELECT g.id, g.title, g.description, COUNT(m.channel_id) AS channel_count
+    SELECT g.id, g.title, g.description, g.priority, COUNT(m.channel_id) AS channel_count
     FROM channel_groups g
     LEFT JOIN channel_group_members m ON m.group_id = g.id
     WHERE g.id = ?
@@ -74,7 +68,7 @@ SQL_GROUP_CHANNEL_IDS = """
 """
 
 SQL_GROUPS_FOR_CHANNEL = """
-    SELECT g.id, g.title, g.description, COUNT(m2.channel_id) AS channel_count
+    SELECT g.id, g.title, g.description, g.priority, COUNT(m2.channel_id) AS channel_count
     FROM channel_groups g
     JOIN channel_group_members m ON m.group_id = g.id
     LEFT JOIN channel_group_members m2 ON m2.group_id = g.id
@@ -128,7 +122,8 @@ SQL_CREATE_CHANNELS_TABLE = """
         title TEXT,
         invite_link TEXT,
         username TEXT,
-        kind TEXT
+        kind TEXT,
+        priority INTEGER NOT NULL DEFAULT 0
     )
 """
 
@@ -140,5 +135,170 @@ SQL_ASSIGNMENTS_FOR_CACHE = """
     SELECT cq.channel_id, q.phrase
     FROM channel_queries cq
     JOIN queries q ON q.id = cq.query_id
-    ORDER BY cq.channel_id
+    ORDER BY cq.channel_id, cq.query_id
+"""
+
+SQL_ASSIGNMENTS_FOR_CHANNELS = """
+    SELECT cq.channel_id, q.phrase
+    FROM channel_queries cq
+    JOIN queries q ON q.id = cq.query_id
+    WHERE cq.channel_id IN ({placeholders})
+    ORDER BY cq.channel_id, cq.query_id
+"""
+
+SQL_QUERY_SETTINGS = """
+    SELECT id, phrase, notify_mode
+    FROM queries
+"""
+
+SQL_QUERY_SETTINGS_FOR_IDS = """
+    SELECT id, phrase, notify_mode
+    FROM queries
+    WHERE id IN ({placeholders})
+"""
+
+SQL_CREATE_MATCHES_TABLE = """
+    CREATE TABLE IF NOT EXISTS matches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        query_id INTEGER NOT NULL,
+        score REAL NOT NULL,
+        score_ms REAL,
+        processing_ms REAL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+SQL_CREATE_MATCHES_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_matches_query ON matches (query_id, created_at)
+"""
+
+SQL_CREATE_QUERY_STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS query_stats (
+        query_id INTEGER PRIMARY KEY,
+        evaluations INTEGER NOT NULL DEFAULT 0,
+        matches INTEGER NOT NULL DEFAULT 0,
+        score_seconds REAL NOT NULL DEFAULT 0,
+        last_match_at TEXT
+    )
+"""
+
+SQL_INSERT_MATCH = """
+    INSERT INTO matches (chat_id, message_id, query_id, score, score_ms, processing_ms)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+SQL_UPSERT_QUERY_STATS = """
+    INSERT INTO query_stats (query_id, evaluations, matches, score_seconds, last_match_at)
+    VALUES (:query_id, :evaluations, :matches, :score_seconds,
+            CASE WHEN :matches > 0 THEN CURRENT_TIMESTAMP END)
+    ON CONFLICT(query_id) DO UPDATE SET
+        evaluations = evaluations + excluded.evaluations,
+        matches = matches + excluded.matches,
+        score_seconds = score_seconds + excluded.score_seconds,
+        last_match_at = COALESCE(excluded.last_match_at, last_match_at)
+"""
+
+SQL_QUERY_STATS = """
+    SELECT query_id, evaluations, matches, score_seconds, last_match_at
+    FROM query_stats
+"""
+
+SQL_RECENT_MATCHES_FOR_QUERY = """
+    SELECT m.chat_id, m.message_id, m.score, m.score_ms, m.processing_ms, m.created_at, c.title, c.username
+    FROM matches m
+    LEFT JOIN channels c ON c.id = m.chat_id
+    WHERE m.query_id = ?
+    ORDER BY m.id DESC
+    LIMIT ?
+"""
+
+SQL_CREATE_ARCHIVE = """
+    CREATE TABLE IF NOT EXISTS archive_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (chat_id, message_id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_archive_messages_created ON archive_messages (created_at);
+    CREATE VIRTUAL TABLE IF NOT EXISTS archive_fts USING fts5(
+        text,
+        content = 'archive_messages',
+        content_rowid = 'id',
+        tokenize = 'unicode61 remove_diacritics 2'
+    );
+    CREATE TRIGGER IF NOT EXISTS archive_messages_ai AFTER INSERT ON archive_messages BEGIN
+        INSERT INTO archive_fts (rowid, text) VALUES (new.id, new.text);
+    END;
+    CREATE TRIGGER IF NOT EXISTS archive_messages_ad AFTER DELETE ON archive_messages BEGIN
+        INSERT INTO archive_fts (archive_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END;
+"""
+
+SQL_INSERT_ARCHIVE_MESSAGE = """
+    INSERT OR IGNORE INTO archive_messages (chat_id, message_id, text)
+    VALUES (?, ?, ?)
+"""
+
+SQL_PRUNE_ARCHIVE_BY_AGE = """
+    DELETE FROM archive_messages
+    WHERE created_at < datetime('now', ?)
+"""
+
+SQL_PRUNE_ARCHIVE_BY_SIZE = """
+    DELETE FROM archive_messages
+    WHERE id <= (SELECT MAX(id) FROM archive_messages) - ?
+"""
+
+SQL_SEARCH_ARCHIVE = """
+    SELECT a.chat_id, a.message_id, a.text, a.created_at, c.title, c.username
+    FROM archive_fts f
+    JOIN archive_messages a ON a.id = f.rowid
+    LEFT JOIN channels c ON c.id = a.chat_id
+    WHERE archive_fts MATCH ?
+    ORDER BY f.rank
+    LIMIT ?
+"""
+
+SQL_CREATE_CHAT_CHECKPOINTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS chat_checkpoints (
+        chat_id INTEGER PRIMARY KEY,
+        message_id INTEGER NOT NULL,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+SQL_UPSERT_CHAT_CHECKPOINT = """
+    INSERT INTO chat_checkpoints (chat_id, message_id)
+    VALUES (?, ?)
+    ON CONFLICT(chat_id) DO UPDATE SET
+        message_id = MAX(message_id, excluded.message_id),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+SQL_CHAT_PRIORITIES = """
+    SELECT c.id AS chat_id, MAX(c.priority, COALESCE(MAX(g.priority), c.priority)) AS priority
+    FROM channels c
+    LEFT JOIN channel_group_members m ON m.channel_id = c.id
+    LEFT JOIN channel_groups g ON g.id = m.group_id
+    GROUP BY c.id
+"""
+
+SQL_CREATE_INVITE_LINK_FAILURES_TABLE = """
+    CREATE TABLE IF NOT EXISTS invite_link_failures (
+        chat_id INTEGER PRIMARY KEY,
+        reason TEXT,
+        failed_at REAL NOT NULL
+    )
+"""
+
+SQL_UPSERT_INVITE_LINK_FAILURE = """
+    INSERT INTO invite_link_failures (chat_id, reason, failed_at)
+    VALUES (?, ?, ?)
+    ON CONFLICT(chat_id) DO UPDATE SET
+        reason = excluded.reason,
+        failed_at = excluded.failed_at
 """
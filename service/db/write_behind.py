@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import atexit
+import logging
+import threading
+from typing import Callable, Generic, List, TypeVar
+
+Row = TypeVar("Row")
+
+
+class WriteBehindBuffer(Generic[Row]):
+    """
+    Collects rows in memory and writes them from a background thread.
+
+    Rows are handed to ``writer`` in batches every ``interval`` seconds or as soon as
+    ``max_rows`` are pending, so callers never wait on SQLite commits. The writer is
+    expected to store a whole batch in one transaction. Pending rows are flushed at exit.
+
+    Attributes:
+        interval (float): Seconds between background flushes.
+        max_rows (int): The number of pending rows that triggers an early flush.
+    """
+
+    def __init__(self, writer: Callable[[List[Row]], None], interval: float = 5, max_rows: int = 500):
+        self.writer = writer
+        self.interval = max(0.1, interval)
+        self.max_rows = max(1, max_rows)
+        self._pending: List[Row] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        atexit.register(self.flush)
+
+    def add(self, row: Row) -> None:
+        with self._lock:
+            self._pending.append(row)
+            size = len(self._pending)
+        if size >= self.max_rows:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """Writes all pending rows right away and returns their number."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                self.writer(batch)
+            except Exception:
+                logging.exception("Write-behind flush of %s rows failed", len(batch))
+                return 0
+            return len(batch)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
@@ -0,0 +1,223 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import Counter as Multiset
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from telethon.errors import FloodWaitError
+
+from service.config import (
+    DELIVERY_BURST,
+    DELIVERY_MAX_RETRIES,
+    DELIVERY_QUEUE_SIZE,
+    DELIVERY_RATE_PER_SECOND,
+)
+from service.db import db
+from service.metrics import Counter, Gauge, Histogram
+from service.read_ack import read_acknowledger
+
+DELIVERY_JOBS = Counter("delivery_jobs_total", "Delivery jobs by final status.", labels=("status",))
+DELIVERY_API_CALLS = Counter("delivery_api_calls_total", "Telegram API calls made to deliver notifications.")
+DELIVERY_MATCHES = Counter("delivery_matches_total", "Matches delivered to the target user.")
+DELIVERY_FLOOD_WAIT = Counter("delivery_flood_wait_seconds_total", "Seconds of FloodWait imposed on deliveries.")
+DELIVERY_LATENCY = Histogram(
+    "delivery_latency_seconds",
+    "Time from queueing a notification to its delivery.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+Step = Callable[[Any], Awaitable[Any]]
+
+
+class TokenBucket:
+    """
+    An asyncio token bucket limiting the rate of outgoing requests.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (int): The maximal number of tokens the bucket can hold.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out tokens for the given time, e.g. after a FloodWait."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class DeliveryJob:
+    """
+    An ordered chain of API calls delivering one notification.
+
+    Every step receives the result of the previous one (None for the first step),
+    so a reply can be attached to the message forwarded by the previous step.
+    Steps that already succeeded are not repeated on retry. ``sources`` are the
+    (chat id, message id) pairs of the matches the notification reports.
+    """
+
+    steps: List[Step]
+    description: str = ""
+    matches: int = 1
+    sources: Tuple[Tuple[int, int], ...] = ()
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class DeliveryQueue:
+    """
+    Sends notifications to the target user from a single worker.
+
+    Jobs are delivered in submission order, every API call takes a token from
+    the rate limiter, FloodWait pauses the limiter for the requested time and
+    other errors are retried with exponential backoff.
+
+    A match holds the checkpoint and the read mark of its chat below it from the moment
+    it is found (see ``hold``) until a job with it among the sources is delivered. A job that
+    is dropped, fails or is still queued at stop keeps its holds, so the next start
+    evaluates its matches again instead of losing them.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 3, max_retries: int = 3, max_size: int = 1000):
+        self.limiter = TokenBucket(rate, burst)
+        self.max_retries = max(0, max_retries)
+        self.max_size = max(1, max_size)
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        # chat id -> ids of the matched messages whose notifications are not delivered yet
+        self._undelivered: Dict[int, Multiset] = {}
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.max_size)
+        return self._queue
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def hold(self, chat_id: int, message_id: int) -> None:
+        self._undelivered.setdefault(chat_id, Multiset())[message_id] += 1
+        self._update_hold(chat_id)
+
+    def _release(self, sources: Tuple[Tuple[int, int], ...]) -> None:
+        for chat_id, message_id in sources:
+            undelivered = self._undelivered.get(chat_id)
+            if undelivered and undelivered[message_id] > 0:
+                undelivered[message_id] -= 1
+                if undelivered[message_id] <= 0:
+                    del undelivered[message_id]
+                self._update_hold(chat_id)
+
+    def _update_hold(self, chat_id: int) -> None:
+        undelivered = self._undelivered.get(chat_id)
+        if undelivered:
+            below = min(undelivered) - 1
+            db.hold_checkpoint(chat_id, below, "delivery")
+            read_acknowledger.hold(chat_id, below, "delivery")
+        else:
+            self._undelivered.pop(chat_id, None)
+            db.release_checkpoint(chat_id, "delivery")
+            read_acknowledger.release(chat_id, "delivery")
+
+    def submit(self, job: DeliveryJob) -> bool:
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            DELIVERY_JOBS.inc(status="dropped")
+            logging.error("Delivery queue is full (%s), notification dropped :: %s", self.max_size, job.description)
+            return False
+        return True
+
+    async def _call(self, step: Step, previous: Any) -> Any:
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            DELIVERY_API_CALLS.inc()
+            try:
+                return await step(previous)
+            except FloodWaitError as exc:
+                DELIVERY_FLOOD_WAIT.inc(exc.seconds)
+                logging.warning("FloodWait %s s on delivery, pausing sends", exc.seconds)
+                self.limiter.pause(exc.seconds)
+            except Exception:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = 2 ** attempt
+                logging.warning("Delivery step failed, retry %s/%s in %s s", attempt, self.max_retries, delay,
+                                exc_info=True)
+                await asyncio.sleep(delay)
+
+    async def _deliver(self, job: DeliveryJob) -> None:
+        result = None
+        try:
+            for step in job.steps:
+                result = await self._call(step, result)
+        except Exception:
+            DELIVERY_JOBS.inc(status="failed")
+            logging.exception("Failed to deliver notification :: %s", job.description)
+            return
+        DELIVERY_JOBS.inc(status="delivered")
+        DELIVERY_MATCHES.inc(job.matches)
+        DELIVERY_LATENCY.observe(time.perf_counter() - job.enqueued_at)
+        self._release(job.sources)
+
+    async def _worker(self) -> None:
+        queue = self.queue
+        while True:
+            job = await queue.get()
+            try:
+                await self._deliver(job)
+            finally:
+                queue.task_done()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+
+    async def stop(self, timeout: float = 30) -> None:
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Delivery queue stopped with %s undelivered notifications", self.qsize())
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+
+delivery_queue = DeliveryQueue(
+    rate=DELIVERY_RATE_PER_SECOND,
+    burst=DELIVERY_BURST,
+    max_retries=DELIVERY_MAX_RETRIES,
+    max_size=DELIVERY_QUEUE_SIZE,
+)
+DELIVERY_DEPTH = Gauge("delivery_queue_depth", "Notifications waiting for delivery.", function=delivery_queue.qsize)
+DELIVERY_MATCHES_PER_CALL = Gauge(
+    "delivery_matches_per_api_call",
+    "Delivered matches per Telegram API call.",
+    function=lambda: DELIVERY_MATCHES.value() / max(1, DELIVERY_API_CALLS.value()),
+)
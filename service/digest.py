@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import html
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from telethon import events
+
+from service.cache import Cache
+from service.config import DIGEST_MAX_ITEMS, DIGEST_WINDOW_SECONDS, TARGET_USER, client
+from service.delivery import DeliveryJob, delivery_queue
+
+MESSAGE_LIMIT = 4000
+REPLY_HINT = "\n\n<i>Ответьте номерами (например, «1 3»), чтобы переслать оригиналы.</i>"
+FORWARD_REQUEST_RE = re.compile(r"^\s*/?(?:fwd\s+)?(\d+(?:[\s,]+\d+)*)\s*$", re.IGNORECASE)
+
+# Sent digest message id -> {item number: (chat id, message ids)}
+digest_entries = Cache(60 * 60 * 24 * 3)
+
+
+@dataclass(frozen=True)
+class DigestItem:
+    chat: str
+    chat_id: int
+    message_ids: Tuple[int, ...]
+    res: Dict[str, float]
+    message_link: str
+    location_link: str
+
+
+def _format_item(number: int, item: DigestItem) -> str:
+    scores = "; ".join(f"{html.escape(query)} :: {score:.0f} %" for query, score in item.res.items())
+    return (
+        f"{number}. <a href='{html.escape(item.location_link)}'>{html.escape(item.chat)}</a> — "
+        f"<a href='{html.escape(item.message_link)}'>сообщение</a>\n"
+        f"{scores}"
+    )
+
+
+def submit_summary(items: List[DigestItem], header: str, footer: str = REPLY_HINT, description: str = "") -> int:
+    """
+    Queues numbered summaries of the items, split into messages of at most MESSAGE_LIMIT characters.
+
+    Replies to a sent summary with item numbers forward the originals. Returns the number of messages.
+    """
+    chunks: List[Tuple[str, Dict[int, Tuple[int, Tuple[int, ...]]]]] = []
+    text, numbers = "", {}
+    for number, item in enumerate(items, start=1):
+        block = _format_item(number, item)
+        if text and len(text) + len(block) + 2 > MESSAGE_LIMIT:
+            chunks.append((text, numbers))
+            text, numbers = "", {}
+        text = f"{text}\n\n{block}" if text else block
+        numbers[number] = (item.chat_id, item.message_ids)
+    chunks.append((text, numbers))
+
+    def make_step(body: str, mapping):
+        async def send(_):
+            sent = await client.send_message(TARGET_USER, f"{header}{body}{footer}", link_preview=False)
+            digest_entries.set(sent.id, mapping)
+            return sent
+        return send
+
+    steps = [make_step(body, mapping) for body, mapping in chunks]
+    sources = tuple((item.chat_id, min(item.message_ids)) for item in items)
+    delivery_queue.submit(DeliveryJob(steps, description=description, matches=len(items), sources=sources))
+    return len(steps)
+
+
+class DigestBuffer:
+    """
+    Collects matches and sends them as one combined message.
+
+    The buffer is flushed ``window`` seconds after the first match arrived or as soon
+    as it holds ``max_items`` matches. Originals are forwarded only when the target
+    user replies to the digest with the item numbers.
+    """
+
+    def __init__(self, window: float = 60, max_items: int = 20):
+        self.window = max(1.0, window)
+        self.max_items = max(1, max_items)
+        self._items: List[DigestItem] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    def add(self, item: DigestItem) -> None:
+        self._items.append(item)
+        if len(self._items) >= self.max_items:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        items, self._items = self._items, []
+        if not items:
+            return
+
+        header = f"<b>Дайджест: совпадений {len(items)}</b>\n\n"
+        sent = submit_summary(items, header, description=f"digest of {len(items)}")
+        logging.info("Digest queued: %s matches in %s messages", len(items), sent)
+
+
+async def _forward_on_demand(event) -> None:
+    mapping = digest_entries.get(event.message.reply_to_msg_id) if event.message.is_reply else None
+    if not mapping:
+        return
+    numbers = [int(value) for value in re.findall(r"\d+", event.pattern_match.group(1))]
+    requested = [mapping[number] for number in numbers if number in mapping]
+    for chat_id, message_ids in requested:
+        async def forward(_, chat_id=chat_id, message_ids=message_ids):
+            return await client.forward_messages(TARGET_USER, list(message_ids), from_peer=chat_id)
+        delivery_queue.submit(DeliveryJob([forward], description=f"digest forward {chat_id}", matches=0))
+
+
+def setup_digest_handlers(client) -> None:
+    client.add_event_handler(
+        _forward_on_demand,
+        events.NewMessage(chats=[TARGET_USER], pattern=FORWARD_REQUEST_RE),
+    )
+
+
+digest_buffer = DigestBuffer(DIGEST_WINDOW_SECONDS, DIGEST_MAX_ITEMS)
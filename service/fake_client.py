@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import asyncio
+import itertools
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from telethon.utils import get_peer_id, resolve_id
+
+
+@dataclass
+class FakeEntity:
+    id: int
+    title: str | None = None
+    username: str | None = None
+    first_name: str | None = None
+    last_name: str | None = None
+
+
+@dataclass
+class FakeMessage:
+    """A stand-in for telethon's Message with the attributes the handlers read."""
+
+    client: "FakeTelegramClient"
+    id: int
+    chat_id: int
+    text: str
+    sender_id: int | None = None
+    grouped_id: int | None = None
+    fwd_from: object = None
+    media: object = None
+    chat: object = None
+    sender: object = None
+    date: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    reply_to_msg_id: int | None = None
+
+    @property
+    def raw_text(self) -> str:
+        return self.text
+
+    @property
+    def peer_id(self):
+        real_id, peer_type = resolve_id(self.chat_id)
+        return peer_type(real_id)
+
+    @property
+    def is_reply(self) -> bool:
+        return self.reply_to_msg_id is not None
+
+    async def forward_to(self, entity):
+        return await self.client.forward_messages(entity, [self.id], from_peer=self.chat_id)
+
+    async def reply(self, text: str, **kwargs):
+        return await self.client.send_message(self.chat_id, text, reply_to=self.id, **kwargs)
+
+
+def _peer_to_id(peer) -> int:
+    if isinstance(peer, int):
+        return peer
+    if isinstance(peer, FakeEntity):
+        return peer.id
+    return get_peer_id(peer)
+
+
+class FakeTelegramClient:
+    """
+    An offline replacement of TelegramClient for replays and throughput tests.
+
+    It implements the subset of the client API used by the service, answers after
+    ``api_latency`` seconds and records every call instead of talking to Telegram.
+    """
+
+    def __init__(self, api_latency: float = 0.0):
+        self.api_latency = api_latency
+        self.parse_mode = "html"
+        self.calls: Counter = Counter()
+        self.sent: List[Tuple[float, str, object]] = []
+        self.delivered_at: Dict[Tuple[int, int], float] = {}
+        self.read_marks: Dict[int, int] = {}
+        self.history: Dict[int, List[FakeMessage]] = {}
+        self.entities: Dict[int, FakeEntity] = {}
+        self._ids = itertools.count(1)
+
+    async def _rpc(self, name: str) -> None:
+        self.calls[name] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    # region helpers for replays ------------------------------------------
+    def start_ids_after(self, message_id: int) -> None:
+        """Makes new message ids start above ``message_id``, e.g. above the stored chat checkpoints."""
+        self._ids = itertools.count(max(message_id, 0) + 1)
+
+    def make_user(self, user_id: int) -> FakeEntity:
+        return self.entities.setdefault(user_id, FakeEntity(id=user_id, first_name=f"User {user_id}"))
+
+    def make_message(self, chat_id: int, text: str, **kwargs) -> FakeMessage:
+        message = FakeMessage(self, next(self._ids), chat_id, text, **kwargs)
+        self.history.setdefault(chat_id, []).append(message)
+        return message
+
+    # region client API -------------------------------------------------
+    def add_event_handler(self, callback, event=None) -> None:
+        pass
+
+    async def get_me(self):
+        await self._rpc("get_me")
+        return self.make_user(0)
+
+    async def get_entity(self, peer):
+        await self._rpc("get_entity")
+        if isinstance(peer, (list, tuple)):
+            return [self._entity(_peer_to_id(item)) for item in peer]
+        return self._entity(_peer_to_id(peer))
+
+    def _entity(self, peer_id: int) -> FakeEntity:
+        return self.entities.setdefault(peer_id, FakeEntity(id=peer_id, title=f"Chat {peer_id}"))
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        await self._rpc("get_messages")
+        by_id = {message.id: message for message in self.history.get(_peer_to_id(entity), [])}
+        return [by_id.get(message_id) for message_id in ids or ()]
+
+    async def get_input_entity(self, peer):
+        real_id, peer_type = resolve_id(_peer_to_id(peer))
+        return peer_type(real_id)
+
+    async def send_message(self, entity, message: str, **kwargs):
+        await self._rpc("send_message")
+        chat_id = getattr(entity, "id", entity)
+        sent = FakeMessage(self, next(self._ids), chat_id, message, reply_to_msg_id=kwargs.get("reply_to"))
+        self.sent.append((time.perf_counter(), "send_message", sent))
+        return sent
+
+    async def forward_messages(self, entity, messages, from_peer=None, **kwargs):
+        await self._rpc("forward_messages")
+        single = not isinstance(messages, (list, tuple))
+        items = [messages] if single else list(messages)
+        now = time.perf_counter()
+        forwarded = []
+        for item in items:
+            message_id = getattr(item, "id", item)
+            chat_id = getattr(item, "chat_id", from_peer)
+            self.delivered_at.setdefault((chat_id, message_id), now)
+            copy = FakeMessage(self, next(self._ids), getattr(entity, "id", entity), getattr(item, "text", ""))
+            self.sent.append((now, "forward_messages", copy))
+            forwarded.append(copy)
+        return forwarded[0] if single else forwarded
+
+    async def send_read_acknowledge(self, entity, message=None, *, max_id=None, **kwargs):
+        await self._rpc("send_read_acknowledge")
+        chat_id = _peer_to_id(entity)
+        if max_id is None and message is not None:
+            items = message if isinstance(message, (list, tuple)) else [message]
+            max_id = max(getattr(item, "id", item) for item in items)
+        if max_id is not None:
+            self.read_marks[chat_id] = max(self.read_marks.get(chat_id, 0), max_id)
+        return True
+
+    async def iter_messages(self, entity, limit: Optional[int] = None, min_id: int = 0, reverse: bool = False,
+                            offset_date: datetime | None = None, max_id: int = 0, **kwargs):
+        await self._rpc("iter_messages")
+        chat_id = _peer_to_id(entity)
+        messages: Sequence[FakeMessage] = [
+            m for m in self.history.get(chat_id, []) if m.id > min_id and (not max_id or m.id < max_id)
+        ]
+        if offset_date and not reverse:
+            messages = [m for m in messages if m.date < offset_date]
+        messages = sorted(messages, key=lambda m: m.id, reverse=not reverse)
+        for message in messages[:limit] if limit else messages:
+            yield message
+
+    async def iter_dialogs(self, **kwargs):
+        await self._rpc("iter_dialogs")
+        for dialog in ():
+            yield dialog
+
+    async def run_until_disconnected(self):
+        await asyncio.Event().wait()
+
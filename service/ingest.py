@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Sequence, Tuple
+
+from service.config import INGEST_LANES, INGEST_OVERFLOW_POLICY, INGEST_QUEUE_SIZE, INGEST_WORKERS, client
+from service.db import db
+from service.main_handler import handle_new_message
+from service.metrics import Counter, Gauge, Histogram
+from service.process_history import BacklogBatch
+from service.read_ack import read_acknowledger
+
+OVERFLOW_POLICIES = ("block", "drop_new", "drop_oldest")
+DROPPED_RETRY_SECONDS = 30
+
+INGEST_WAIT = Histogram("ingest_wait_seconds", "Time an update waited in the ingest queue.", labels=("lane",))
+INGEST_DROPPED = Counter("ingest_dropped_total", "Updates dropped because the ingest queue was full.", labels=("lane",))
+INGEST_PROCESSED = Counter("ingest_processed_total", "Updates taken from the ingest queue by workers.", labels=("lane",))
+INGEST_RECOVERED = Counter("ingest_recovered_total", "Dropped messages fetched again and evaluated.")
+
+
+class IngestQueue:
+    """
+    A bounded queue between Telethon event handlers and message processing.
+
+    Handlers only enqueue updates, a fixed pool of workers processes them.
+    Updates are split into lanes by the priority of their chat: ``lanes`` is a list of
+    (minimal priority, weight) pairs, an update goes to the first lane its priority reaches
+    (the last one otherwise). Workers take updates with smooth weighted round-robin, so a lane
+    of weight 4 gets four updates for every one of a lane of weight 1 while both are busy,
+    and an idle lane costs nothing. Workers yield to the event loop after every update, so a new
+    update enters its lane while a burst is still being processed and is taken by the next free worker.
+
+    Every lane holds up to ``max_size`` updates. When it is full the overflow policy decides:
+    ``block`` waits for free space, ``drop_new`` discards the incoming update
+    and ``drop_oldest`` discards the longest waiting one. Every dropped update is passed
+    to ``on_drop``.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[object], Awaitable],
+        workers: int = 4,
+        max_size: int = 10000,
+        overflow_policy: str = "drop_oldest",
+        lanes: Sequence[Tuple[int, int]] = ((0, 1),),
+        priority_of: Callable[[object], int] = lambda event: 0,
+        on_drop: Callable[[object], None] = lambda event: None,
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown ingest overflow policy: {overflow_policy}")
+        if not lanes or any(weight <= 0 for _, weight in lanes):
+            raise ValueError("Ingest lanes must have positive weights")
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max(1, max_size)
+        self.overflow_policy = overflow_policy
+        self.lanes: List[Tuple[int, int]] = sorted(lanes, key=lambda lane: lane[0], reverse=True)
+        self.priority_of = priority_of
+        self.on_drop = on_drop
+        self._items: List[Deque[Tuple[float, object]]] = [deque() for _ in self.lanes]
+        self._credits: List[int] = [0 for _ in self.lanes]
+        self._available: asyncio.Semaphore | None = None
+        self._space: asyncio.Condition | None = None
+        self._idle: asyncio.Event | None = None
+        self._unfinished = 0
+        self._tasks: List[asyncio.Task] = []
+
+    def _primitives(self) -> Tuple[asyncio.Semaphore, asyncio.Condition, asyncio.Event]:
+        if self._available is None:
+            self._available = asyncio.Semaphore(0)
+            self._space = asyncio.Condition()
+            self._idle = asyncio.Event()
+            self._idle.set()
+        return self._available, self._space, self._idle
+
+    def lane_of(self, event) -> int:
+        try:
+            priority = self.priority_of(event)
+        except Exception:
+            priority = 0
+        for index, (min_priority, _) in enumerate(self.lanes):
+            if priority >= min_priority:
+                return index
+        return len(self.lanes) - 1
+
+    def qsize(self, lane: int | None = None) -> int:
+        if lane is not None:
+            return len(self._items[lane])
+        return sum(len(items) for items in self._items)
+
+    async def submit(self, event) -> None:
+        _, space, _ = self._primitives()
+        lane = self.lane_of(event)
+        items = self._items[lane]
+        if len(items) < self.max_size:
+            self._put(lane, event)
+            return
+        if self.overflow_policy == "block":
+            async with space:
+                await space.wait_for(lambda: len(items) < self.max_size)
+                self._put(lane, event)
+            return
+        INGEST_DROPPED.inc(lane=lane)
+        if self.overflow_policy == "drop_new":
+            logging.warning("Ingest lane %s is full (%s), update dropped", lane, self.max_size)
+            self._dropped(event)
+            return
+        # The new update takes the place of the dropped one, the counters stay as they are
+        _, dropped = items.popleft()
+        items.append((time.perf_counter(), event))
+        logging.warning("Ingest lane %s is full (%s), the oldest update dropped", lane, self.max_size)
+        self._dropped(dropped)
+
+    def _dropped(self, event) -> None:
+        try:
+            self.on_drop(event)
+        except Exception:
+            logging.exception("Failed to handle a dropped update")
+
+    def _put(self, lane: int, event) -> None:
+        available, _, idle = self._primitives()
+        self._items[lane].append((time.perf_counter(), event))
+        self._unfinished += 1
+        idle.clear()
+        available.release()
+
+    def _next_lane(self) -> int:
+        """Smooth weighted round-robin over the lanes that have updates."""
+        total, chosen = 0, -1
+        for index, (_, weight) in enumerate(self.lanes):
+            if not self._items[index]:
+                continue
+            self._credits[index] += weight
+            total += weight
+            if chosen < 0 or self._credits[index] > self._credits[chosen]:
+                chosen = index
+        self._credits[chosen] -= total
+        return chosen
+
+    def _task_done(self) -> None:
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._unfinished = 0
+            self._idle.set()
+
+    async def join(self) -> None:
+        await self._primitives()[2].wait()
+
+    async def _worker(self) -> None:
+        available, space, _ = self._primitives()
+        while True:
+            await available.acquire()
+            lane = self._next_lane()
+            enqueued_at, event = self._items[lane].popleft()
+            if self.overflow_policy == "block":
+                async with space:
+                    space.notify_all()
+            INGEST_WAIT.observe(time.perf_counter() - enqueued_at, lane=lane)
+            INGEST_PROCESSED.inc(lane=lane)
+            try:
+                await self.handler(event)
+            except Exception:
+                logging.exception("Ingest worker failed to process an update")
+            finally:
+                self._task_done()
+            # A typical update is handled without suspending, give Telethon, delivery and the web server a turn
+            await asyncio.sleep(0)
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._primitives()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logging.info("Ingest queue started: workers=%s, size=%s, policy=%s, lanes=%s",
+                     self.workers, self.max_size, self.overflow_policy, self.lanes)
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def chat_priority(event) -> int:
+    return db.get_chat_priority(event.chat_id)
+
+
+class DroppedUpdates:
+    """
+    Evaluates updates the ingest queue had to drop once it has room again.
+
+    Until then the checkpoint and the read mark of the chat are held below the first dropped
+    message, so a restart in between resumes the backlog before it. Every ``interval`` seconds,
+    while the queue is at most half full and once more on stop, only the dropped ids are fetched
+    again and go through the backlog delivery, then the holds are released.
+    """
+
+    def __init__(self, client, queue: IngestQueue, interval: float = DROPPED_RETRY_SECONDS):
+        self.client = client
+        self.queue = queue
+        self.interval = max(0.1, interval)
+        # chat id -> ids of the dropped updates, one tuple per update (an album has several)
+        self._pending: Dict[int, List[Tuple[int, ...]]] = {}
+        self._task: asyncio.Task | None = None
+
+    def add(self, event) -> None:
+        messages = getattr(event, "messages", None) or [getattr(event, "message", event)]
+        chat_id = event.chat_id
+        self._pending.setdefault(chat_id, []).append(tuple(message.id for message in messages))
+        self._hold(chat_id)
+
+    def _hold(self, chat_id: int) -> None:
+        below = min(min(ids) for ids in self._pending[chat_id]) - 1
+        db.hold_checkpoint(chat_id, below, "dropped")
+        read_acknowledger.hold(chat_id, below, "dropped")
+
+    async def recover(self) -> None:
+        for chat_id in list(self._pending):
+            updates = self._pending.pop(chat_id)
+            try:
+                peer = await self.client.get_input_entity(chat_id)
+                ids = [message_id for message_ids in updates for message_id in message_ids]
+                fetched = await self.client.get_messages(peer, ids=ids)
+            except Exception as exc:
+                logging.warning("Failed to fetch %s dropped updates of %s: %s", len(updates), chat_id, exc)
+                self._pending.setdefault(chat_id, []).extend(updates)
+                continue
+            by_id = {message.id: message for message in fetched if message is not None}
+            batch = BacklogBatch(chat_id, peer)
+            for message_ids in updates:
+                messages = [by_id[message_id] for message_id in message_ids if message_id in by_id]
+                if messages:
+                    await handle_new_message(messages, batch.add, from_backlog=True)
+                    INGEST_RECOVERED.inc(len(messages))
+            batch.submit()
+            # Updates dropped while this batch was evaluated have already moved the holds
+            if chat_id not in self._pending:
+                db.release_checkpoint(chat_id, "dropped")
+                read_acknowledger.release(chat_id, "dropped")
+            logging.info("Evaluated %s dropped updates of %s", len(updates), chat_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._pending and self.queue.qsize() <= self.queue.max_size // 2:
+                await self.recover()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # The connection is still up; whatever fails stays held and is evaluated on the next start
+        await self.recover()
+
+
+ingest_queue = IngestQueue(
+    handle_new_message,
+    workers=INGEST_WORKERS,
+    max_size=INGEST_QUEUE_SIZE,
+    overflow_policy=INGEST_OVERFLOW_POLICY,
+    lanes=INGEST_LANES,
+    priority_of=chat_priority,
+)
+dropped_updates = DroppedUpdates(client, ingest_queue)
+ingest_queue.on_drop = dropped_updates.add
+INGEST_DEPTH = Gauge("ingest_queue_depth", "Updates waiting in the ingest queue.", labels=("lane",))
+for _lane in range(len(ingest_queue.lanes)):
+    INGEST_DEPTH.set_function(lambda lane=_lane: ingest_queue.qsize(lane), lane=_lane)
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Dict, List
+
+TEXT_FORMAT = "%(levelname)s:%(name)s - %(message)s"
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, extra fields included."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                payload[key] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class LazyText:
+    """
+    A log argument built only when the record is formatted.
+
+    Pass it with %-style formatting, ``logging.info("Skipped :: %s", LazyText(...))``: records
+    dropped by a filter are never formatted, so the text is not built for them.
+    """
+
+    __slots__ = ("_build",)
+
+    def __init__(self, build: Callable[[], str]):
+        self._build = build
+
+    def __str__(self) -> str:
+        return self._build()
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Rate-limits records marked with ``extra={"sample": "<category>"}``.
+
+    At most ``per_minute`` records of every category pass per minute. The number of suppressed
+    ones is reported once the minute is over, by a background thread every ``interval`` seconds
+    and by ``flush`` at exit, so it shows up even when no record of the category follows.
+    Unmarked records always pass.
+    """
+
+    def __init__(self, per_minute: int, interval: float = 10):
+        super().__init__()
+        self.per_minute = per_minute
+        self.interval = max(0.1, interval)
+        self._windows: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        if per_minute > 0:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        category = getattr(record, "sample", None)
+        if not category or self.per_minute <= 0:
+            return True
+        now = time.monotonic()
+        suppressed = 0
+        with self._lock:
+            window = self._windows.setdefault(category, [now, 0, 0])
+            if now - window[0] >= 60:
+                suppressed = window[2]
+                window[:] = [now, 0, 0]
+            window[1] += 1
+            passed = window[1] <= self.per_minute
+            if not passed:
+                window[2] += 1
+        if suppressed:
+            self._report(category, suppressed)
+        return passed
+
+    def flush(self, force: bool = True) -> None:
+        """Reports the suppressed counts of finished windows, of all windows when ``force`` is set."""
+        now = time.monotonic()
+        reports = []
+        with self._lock:
+            for category, window in self._windows.items():
+                if window[2] and (force or now - window[0] >= 60):
+                    reports.append((category, window[2]))
+                    window[:] = [now, 0, 0] if force else [window[0], window[1], 0]
+        for category, suppressed in reports:
+            self._report(category, suppressed)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+    def _report(self, category: str, suppressed: int) -> None:
+        logging.getLogger(__name__).info("Suppressed %s '%s' log lines during the last minute", suppressed, category)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self.flush(force=False)
+
+
+def setup_logging(level: int = logging.INFO, log_format: str = "text", sampled_per_minute: int = 0) -> None:
+    """
+    Routes all logging through a queue, so the caller never waits on the stream I/O.
+
+    The actual writing happens in a QueueListener thread, which is stopped at exit.
+    """
+    formatter = JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    sampling_filter = SamplingFilter(sampled_per_minute)
+    queue_handler.addFilter(sampling_filter)
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    # atexit runs in reverse order: the last counts are reported before the listener stops
+    atexit.register(sampling_filter.stop)
@@ -1,25 +1,69 @@
-import asyncio
-import hashlib
 import html
 import logging
-import traceback
+import time
 
 from rapidfuzz import fuzz
 from telethon import events
 from telethon.tl import types
+from telethon.utils import get_peer_id
 
 from service.cache import Cache
-from service.config import client, TARGET_USER
-from service.db import db
+from service.config import (
+    client,
+    TARGET_USER,
+    EXCERPT_LENGTH,
+    FORWARD_INDEX_MAX_SIZE,
+    FORWARD_INDEX_TTL_SECONDS,
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    NEAR_DUPLICATE_TTL_SECONDS,
+    NOTIFY_MODE,
+    PIPELINE_STAGES,
+)
+from service.db import NOTIFY_MODES, db
+from service.delivery import DeliveryJob, delivery_queue
+from service.digest import DigestItem, digest_buffer
+from service.metrics import Counter, Histogram
+from service.pipeline import MessageContext, Pipeline
+from service.read_ack import read_acknowledger
 from service.search_engine import find_queries
+from service.simhash import SimHashIndex
 from service.utils import get_chat_name, get_message_source_link
 
-message_mutex = asyncio.Lock()
 duplicate_cache = Cache(60 * 60 * 12)
 advanced_duplicate_cache = Cache(60 * 15)
+near_duplicate_index = SimHashIndex(NEAR_DUPLICATE_MAX_DISTANCE, ttl=NEAR_DUPLICATE_TTL_SECONDS)
+forwarded_verdicts = Cache(FORWARD_INDEX_TTL_SECONDS, max_size=FORWARD_INDEX_MAX_SIZE)
 
+MESSAGES_RECEIVED = Counter("messages_received_total", "Messages received from tracked chats.", labels=("chat",))
+QUERY_MATCHES = Counter("query_matches_total", "Matches per query.", labels=("query",))
+DEDUP_REJECTS = Counter("dedup_rejects_total", "Messages rejected as duplicates.", labels=("reason",))
+FIND_QUERIES_SECONDS = Histogram("find_queries_seconds", "Time spent scoring a message against its queries.")
 
-async def handle_new_message(event: events.newmessage.NewMessage.Event, forward_func=None):
+
+def _original_post_key(message):
+    """Returns (peer id, message id) of the post a message was forwarded from, if Telegram tells it."""
+    fwd = getattr(message, "fwd_from", None)
+    if not fwd:
+        return None
+    try:
+        if fwd.from_id and fwd.channel_post:
+            return get_peer_id(fwd.from_id), fwd.channel_post
+        if fwd.saved_from_peer and fwd.saved_from_msg_id:
+            return get_peer_id(fwd.saved_from_peer), fwd.saved_from_msg_id
+    except Exception:
+        return None
+    return None
+
+
+def _remember_verdict(message, queries, res) -> None:
+    verdict = (frozenset(queries), res)
+    forwarded_verdicts.set((message.chat_id, message.id), verdict)
+    original_key = _original_post_key(message)
+    if original_key:
+        forwarded_verdicts.set(original_key, verdict)
+
+
+async def handle_new_message(event: events.newmessage.NewMessage.Event, collect=None, from_backlog=False):
     try:
         if hasattr(event, 'messages'):
             messages = event.messages
@@ -34,49 +78,65 @@ async def handle_new_message(event: events.newmessage.NewMessage.Event, forward_
         queries = db.get_queries_for_chat(chat_id)
         if not queries:
             return
+        MESSAGES_RECEIVED.inc(messages_count, chat=chat_id)
 
         entity = getattr(message, 'chat', None) or getattr(message, 'peer_id', None)
         if not entity and hasattr(event, 'chat'):
             entity = event.chat
 
-        await process_message(event, forward_func, message, queries, messages_count)
-        await client.send_read_acknowledge(entity, messages)
+        message_ids = tuple(m.id for m in messages) if isinstance(messages, list) else (messages.id,)
+        max_id = max(message_ids)
+        # The backlog starts from the checkpoints of the previous run, live messages may have moved them since
+        if not from_backlog and max_id <= db.get_checkpoint(chat_id):
+            logging.info("Already evaluated :: %s :: mid:%s", chat_id, max_id, extra={"sample": "skipped"})
+            return
+        ctx = MessageContext(event, collect, message, queries, messages_count, message_ids)
+        await pipeline.run(ctx)
+        db.advance_checkpoint(chat_id, max_id)
+        read_acknowledger.mark(chat_id, entity, max_id)
     except Exception as e:
-        logging.error(f"Ошибка обработки сообщения: {e.__class__}: {e}\n"
-                      f"{traceback.print_exc()}")
+        logging.exception(f"Ошибка обработки сообщения: {e.__class__}: {e}")
 
 
-async def process_message(event, forward_func, message, queries, messages_count):
-    chat_id  = message.chat_id
-    chat = await get_chat_name(message)
-    mess_info = f"{chat_id} :: {chat} :: mid:{message.id}"
+async def reject_stage(ctx: MessageContext) -> bool:
+    message = ctx.message
+    original_key = _original_post_key(message)
+    if original_key:
+        verdict = forwarded_verdicts.get(original_key)
+        if verdict and verdict[0].issuperset(ctx.queries):
+            logging.info("Forward of evaluated post skipped :: %s :: from %s/%s :: %s",
+                         ctx.mess_info, original_key[0], original_key[1], verdict[1] or "no match",
+                         extra=ctx.log_extra("skipped"))
+            return False
 
     if not message.text:
-        logging.info(f"No text :: {mess_info}")
-        return None
+        logging.info("No text :: %s", ctx.mess_info, extra=ctx.log_extra("skipped"))
+        return False
 
-    text = message.text.lower()
-    trep = text.replace('\n', '|')
-    skip_info = f"{mess_info} :: {trep}"
+    if db.is_message_blocked(ctx.message_hash, ctx.fingerprint):
+        logging.info("Blocked message skipped :: %s", ctx.skip_info, extra=ctx.log_extra("skipped"))
+        return False
+    return True
 
-    sender_id = message.sender_id if message.sender_id else message.chat_id
-    cache_key = f"{sender_id}_{messages_count}"
 
-    message_hash = hashlib.sha256(text.encode()).hexdigest()
-    if db.is_message_blocked(message_hash):
-        logging.info(f"Blocked message skipped :: {skip_info}")
-        return None
+async def dedup_stage(ctx: MessageContext) -> bool:
+    message = ctx.message
+    text = ctx.text
+    sender_id = message.sender_id if message.sender_id else message.chat_id
+    cache_key = f"{sender_id}_{ctx.messages_count}"
 
-    previous_messages_count = duplicate_cache.get(message_hash)
-    duplicate_cache.set(message_hash, messages_count)
+    previous_messages_count = duplicate_cache.get(ctx.message_hash)
+    duplicate_cache.set(ctx.message_hash, ctx.messages_count)
 
     previous_message = advanced_duplicate_cache.get(cache_key)
     previous_message_length = len(previous_message) if previous_message else 0
     advanced_duplicate_cache.set(cache_key, text)
 
     if previous_messages_count:
-        logging.info(f"Duplicate skipped mc {messages_count} :: {skip_info}")
-        return None
+        DEDUP_REJECTS.inc(reason="exact")
+        logging.info("Duplicate skipped mc %s :: %s", ctx.messages_count, ctx.skip_info,
+                     extra=ctx.log_extra("duplicate"))
+        return False
 
     if previous_message_length:
         length_difference = abs(previous_message_length - len(text))
@@ -84,26 +144,156 @@ async def process_message(event, forward_func, message, queries, messages_count)
         if percentage_difference <= 10 and previous_message:
             similarity = fuzz.token_sort_ratio(text, previous_message)
             if similarity > 93:
-                logging.info(f"Duplicate by similarity ({similarity:.1f}) :: {skip_info}")
-                return None
+                DEDUP_REJECTS.inc(reason="sender_similarity")
+                logging.info("Duplicate by similarity (%.1f) :: %s", similarity, ctx.skip_info,
+                             extra=ctx.log_extra("duplicate"))
+                return False
+
+    fingerprint = ctx.fingerprint
+    if fingerprint is not None:
+        near_duplicate = near_duplicate_index.find(fingerprint)
+        near_duplicate_index.add(ctx.message_hash, fingerprint)
+        if near_duplicate:
+            DEDUP_REJECTS.inc(reason="near_duplicate")
+            logging.info("Near duplicate skipped (distance %s) :: %s", near_duplicate[1], ctx.skip_info,
+                         extra=ctx.log_extra("duplicate"))
+            return False
+    return True
+
+
+async def archive_stage(ctx: MessageContext) -> bool:
+    db.archive_message(ctx.chat_id, ctx.message.id, ctx.message.text)
+    return True
+
+
+async def prefilter_stage(ctx: MessageContext) -> bool:
+    # Queries are made of words, a text without letters or digits can not match any of them
+    if not any(char.isalnum() for char in ctx.text):
+        logging.info("No words :: %s", ctx.skip_info, extra=ctx.log_extra("skipped"))
+        return False
+    return True
+
+
+def _record_evaluations(ctx: MessageContext, timings) -> None:
+    evaluations = []
+    for query, seconds in timings.items():
+        query_id = db.get_query_id(query)
+        if query_id is not None:
+            evaluations.append((query_id, ctx.res.get(query), seconds))
+    if evaluations:
+        db.record_evaluations(ctx.chat_id, ctx.message.id, evaluations, time.perf_counter() - ctx.received_at)
 
-    res = find_queries(queries, text)
-    if not res:
-        logging.info(f"Skipped :: {skip_info}")
-        return None
 
-    message_link, location_link = await get_message_source_link(message)
-    scores = "\n".join([f'{i} :: {v:.0f} %' for i, v in res.items()])
-    infomes = (
+async def score_stage(ctx: MessageContext) -> bool:
+    timings = {}
+    with FIND_QUERIES_SECONDS.time():
+        ctx.res = find_queries(ctx.queries, ctx.text, timings)
+    for query in ctx.res:
+        QUERY_MATCHES.inc(query=query)
+    _remember_verdict(ctx.message, ctx.queries, ctx.res)
+    _record_evaluations(ctx, timings)
+    if not ctx.res:
+        logging.info("Skipped :: %s", ctx.skip_info, extra=ctx.log_extra("skipped"))
+        return False
+    return True
+
+
+async def link_stage(ctx: MessageContext) -> bool:
+    ctx.chat = await get_chat_name(ctx.message)
+    ctx.message_link, ctx.location_link = await get_message_source_link(ctx.message)
+    return True
+
+
+def _notify_mode(res) -> str:
+    modes = {db.get_query_notify_mode(query) or NOTIFY_MODE for query in res}
+    return next((mode for mode in NOTIFY_MODES if mode in modes), NOTIFY_MODE)
+
+
+def _has_media(message) -> bool:
+    media = getattr(message, "media", None)
+    return bool(media) and not isinstance(media, types.MessageMediaWebPage)
+
+
+def _format_info(ctx: MessageContext, with_excerpt: bool = False) -> str:
+    scores = "\n".join([f'{i} :: {v:.0f} %' for i, v in ctx.res.items()])
+    excerpt = ""
+    if with_excerpt:
+        raw_text = ctx.message.raw_text or ""
+        if len(raw_text) > EXCERPT_LENGTH:
+            raw_text = f"{raw_text[:EXCERPT_LENGTH]}…"
+        excerpt = f"<blockquote>{html.escape(raw_text)}</blockquote>\n"
+    return (
         f"<b>Сработало условие</b>\n"
-        f"<a href='{html.escape(location_link)}'>{html.escape(chat)}</a>\n"
-        f"id: <code>{chat_id}</code>\n\n"
+        f"<a href='{html.escape(ctx.location_link)}'>{html.escape(ctx.chat)}</a>\n"
+        f"id: <code>{ctx.chat_id}</code>\n\n"
         f"{scores}\n\n"
-        f"<a href='{html.escape(message_link)}'>Сообщение</a>"
+        f"{excerpt}"
+        f"<a href='{html.escape(ctx.message_link)}'>Сообщение</a>"
     )
-    async with message_mutex:
-        forwarded = await event.forward_to(TARGET_USER) if not forward_func else await forward_func()
+
+
+async def deliver_stage(ctx: MessageContext) -> bool:
+    mode = _notify_mode(ctx.res)
+    if mode == "single" and _has_media(ctx.message):
+        # An excerpt can not carry media, such matches are forwarded
+        mode = "forward"
+    ctx.notify_mode = mode
+    # The checkpoint and the read mark stay below the match until it is delivered
+    source = (ctx.chat_id, min(ctx.message_ids))
+    delivery_queue.hold(*source)
+    if ctx.collect:
+        ctx.collect(ctx)
+        logging.info(f"👀 collected :: {ctx.mess_info} :: {ctx.res} :: {ctx.trep[:64]}...", extra=ctx.log_extra())
+        return True
+
+    if mode == "digest":
+        digest_buffer.add(DigestItem(
+            chat=ctx.chat,
+            chat_id=ctx.chat_id,
+            message_ids=ctx.message_ids,
+            res=ctx.res,
+            message_link=ctx.message_link,
+            location_link=ctx.location_link,
+        ))
+        logging.info(f"👀 digest :: {ctx.mess_info} :: {ctx.res} :: {ctx.trep[:64]}...", extra=ctx.log_extra())
+        return True
+
+    if mode == "single":
+        infomes = _format_info(ctx, with_excerpt=True)
+
+        async def send(_):
+            return await client.send_message(TARGET_USER, infomes, link_preview=False)
+
+        delivery_queue.submit(DeliveryJob([send], description=ctx.mess_info, sources=(source,)))
+        logging.info(f"👀 single :: {ctx.mess_info} :: {ctx.res} :: {ctx.trep[:64]}...", extra=ctx.log_extra())
+        return True
+
+    infomes = _format_info(ctx)
+    event = ctx.event
+
+    async def forward(_):
+        return await event.forward_to(TARGET_USER)
+
+    async def reply(forwarded):
         if isinstance(forwarded, list):
             forwarded = forwarded[0]
-        await forwarded.reply(infomes)
-    logging.info(f"👀 {mess_info} :: {res} :: {trep[:64]}...")
+        return await forwarded.reply(infomes)
+
+    delivery_queue.submit(DeliveryJob([forward, reply], description=ctx.mess_info, sources=(source,)))
+    logging.info(f"👀 {ctx.mess_info} :: {ctx.res} :: {ctx.trep[:64]}...", extra=ctx.log_extra())
+    return True
+
+
+if NOTIFY_MODE not in NOTIFY_MODES:
+    raise ValueError(f"Unknown NOTIFY_MODE: {NOTIFY_MODE}")
+
+STAGES = {
+    "reject": reject_stage,
+    "dedup": dedup_stage,
+    "archive": archive_stage,
+    "prefilter": prefilter_stage,
+    "score": score_stage,
+    "link": link_stage,
+    "deliver": deliver_stage,
+}
+pipeline = Pipeline(STAGES, PIPELINE_STAGES, required=("score", "link", "deliver"))
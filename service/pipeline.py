@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import hashlib
+import time
+from dataclasses import dataclass, field
+from functools import cached_property
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from service.config import LOG_TEXT_LIMIT
+from service.logging_setup import LazyText
+from service.metrics import Counter, Histogram
+from service.simhash import text_fingerprint
+from service.utils import extract_title_from_message
+
+STAGE_REJECTS = Counter(
+    "pipeline_stage_rejects_total",
+    "Messages rejected by a pipeline stage.",
+    labels=("stage",),
+)
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_seconds",
+    "Time spent in a pipeline stage.",
+    labels=("stage",),
+)
+
+
+@dataclass
+class MessageContext:
+    """State of one message (or album) travelling through the pipeline."""
+
+    event: object
+    collect: Optional[Callable[["MessageContext"], None]]
+    message: object
+    queries: Tuple[str, ...]
+    messages_count: int
+    message_ids: Tuple[int, ...] = ()
+    res: Dict[str, float] = field(default_factory=dict)
+    chat: str = ""
+    message_link: str = ""
+    location_link: str = ""
+    notify_mode: str = ""
+    received_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def chat_id(self) -> int:
+        return self.message.chat_id
+
+    @cached_property
+    def text(self) -> str:
+        return (self.message.text or "").lower()
+
+    @cached_property
+    def trep(self) -> str:
+        return self.text.replace('\n', '|')
+
+    @cached_property
+    def message_hash(self) -> str:
+        return hashlib.sha256(self.text.encode()).hexdigest()
+
+    @cached_property
+    def fingerprint(self) -> int | None:
+        return text_fingerprint(self.text)
+
+    @property
+    def mess_info(self) -> LazyText:
+        """Chat and message id for log lines, built only when the record is formatted."""
+        return LazyText(self._mess_info)
+
+    @property
+    def skip_info(self) -> LazyText:
+        """``mess_info`` with the shortened text, built only when the record is formatted."""
+        return LazyText(self._skip_info)
+
+    def _mess_info(self) -> str:
+        title = self.chat or extract_title_from_message(self.message) or "?"
+        return f"{self.chat_id} :: {title} :: mid:{self.message.id}"
+
+    def _skip_info(self) -> str:
+        text = self.trep
+        if LOG_TEXT_LIMIT and len(text) > LOG_TEXT_LIMIT:
+            text = f"{text[:LOG_TEXT_LIMIT]}…"
+        return f"{self._mess_info()} :: {text}"
+
+    def log_extra(self, sample: str | None = None) -> dict:
+        """Structured fields attached to the log records of this message."""
+        extra = {"chat_id": self.chat_id, "message_id": self.message.id}
+        if sample:
+            extra["sample"] = sample
+        return extra
+
+
+Stage = Callable[[MessageContext], Awaitable[bool]]
+
+
+class Pipeline:
+    """
+    Runs a message through an ordered list of stages.
+
+    Every stage returns True to pass the message further or False to reject it.
+    Rejections and stage latency are recorded per stage name.
+    """
+
+    def __init__(self, stages: Dict[str, Stage], order: Sequence[str], required: Sequence[str] = ()):
+        unknown = [name for name in order if name not in stages]
+        if unknown:
+            raise ValueError(f"Unknown pipeline stages: {', '.join(unknown)}")
+        if len(set(order)) != len(order):
+            raise ValueError("Pipeline stages must not repeat")
+        positions = [order.index(name) if name in order else -1 for name in required]
+        if -1 in positions or positions != sorted(positions):
+            raise ValueError(f"Pipeline must contain stages {', '.join(required)} in this order")
+        self.order = tuple(order)
+        self._stages: List[Tuple[str, Stage]] = [(name, stages[name]) for name in order]
+
+    async def run(self, ctx: MessageContext) -> bool:
+        for name, stage in self._stages:
+            started = time.perf_counter()
+            try:
+                passed = await stage(ctx)
+            finally:
+                STAGE_LATENCY.observe(time.perf_counter() - started, stage=name)
+            if not passed:
+                STAGE_REJECTS.inc(stage=name)
+                return False
+        return True
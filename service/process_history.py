@@ -1,68 +1,296 @@
+import asyncio
 import logging
-import traceback
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
 from service.db import db
 from telethon import functions
-from service.config import client, TARGET_USER
+from telethon.errors import FloodWaitError
+from telethon.utils import get_peer_id
+from service.config import (
+    client,
+    TARGET_USER,
+    BACKLOG_CONCURRENCY,
+    BACKLOG_MAX_AGE_HOURS,
+    BACKLOG_MAX_MESSAGES_PER_CHAT,
+    BACKLOG_SLICE_SIZE,
+)
+from service.delivery import DeliveryJob, delivery_queue
+from service.digest import REPLY_HINT, DigestItem, submit_summary
 from service.main_handler import handle_new_message
+from service.metrics import Counter
+
+PEER_DIALOGS_BATCH_SIZE = 100
+FORWARD_BATCH_SIZE = 100
+
+BACKLOG_MESSAGES = Counter("backlog_messages_total", "Unread messages scanned during the startup catch-up.")
 
 
 # last_readed_id = result.messages[0].id
 # unreaded_count = result.dialogs[0].unread_count
 
-async def analyse(messages):
-    def fwd():
-        return client.forward_messages(TARGET_USER, messages)
+class BacklogBatch:
+    """
+    Collects the backlog matches of one chat and delivers them together.
+
+    Originals of matches in the forward notify mode are forwarded with the list form of
+    forward_messages, FORWARD_BATCH_SIZE messages per call; digest and single matches are
+    only listed in the numbered report with the scores that follows.
+    """
+
+    def __init__(self, chat_id, peer):
+        self.chat_id = chat_id
+        self.peer = peer
+        self.items = []
+        self.forward_ids = []
+
+    def add(self, ctx) -> None:
+        if ctx.notify_mode == "forward":
+            self.forward_ids.extend(ctx.message_ids)
+        self.items.append(DigestItem(
+            chat=ctx.chat,
+            chat_id=ctx.chat_id,
+            message_ids=ctx.message_ids,
+            res=ctx.res,
+            message_link=ctx.message_link,
+            location_link=ctx.location_link,
+        ))
+        if sum(len(item.message_ids) for item in self.items) >= FORWARD_BATCH_SIZE:
+            self.submit()
 
+    def submit(self) -> None:
+        items, self.items = self.items, []
+        message_ids, self.forward_ids = self.forward_ids, []
+        if not items:
+            return
+        for start in range(0, len(message_ids), FORWARD_BATCH_SIZE):
+            chunk = message_ids[start:start + FORWARD_BATCH_SIZE]
+
+            async def forward(_, chunk=chunk):
+                return await client.forward_messages(TARGET_USER, chunk, from_peer=self.peer)
+
+            delivery_queue.submit(DeliveryJob([forward], description=f"backlog {self.chat_id}", matches=0))
+        header = f"<b>Непрочитанное: совпадений {len(items)}</b>\n\n"
+        # Matches that were not forwarded can still be requested by replying to the report
+        footer = REPLY_HINT if sum(len(item.message_ids) for item in items) > len(message_ids) else ""
+        submit_summary(items, header, footer=footer, description=f"backlog report {self.chat_id}")
+
+
+async def analyse(messages, batch: BacklogBatch):
     if messages:
-        await handle_new_message(
-            messages[0] if isinstance(messages, list) else messages,
-            fwd
+        await handle_new_message(messages, batch.add, from_backlog=True)
+        # Live messages move the checkpoint past the backlog, only the scanned prefix may be stored
+        db.hold_checkpoint(batch.chat_id, messages[-1].id, "backlog")
+
+
+class BacklogProgress:
+    """Counts processed chats and messages and reports them to the log."""
+
+    def __init__(self, total_chats: int):
+        self.total_chats = total_chats
+        self.done_chats = 0
+        self.messages = 0
+        self.started = time.perf_counter()
+
+    def add_messages(self, count: int) -> None:
+        self.messages += count
+        BACKLOG_MESSAGES.inc(count)
+
+    def chat_done(self, chat_id, messages: int) -> None:
+        self.done_chats += 1
+        logging.info(
+            f"Backlog {self.done_chats}/{self.total_chats} :: chat {chat_id} :: {messages} messages :: "
+            f"{self.messages} total in {time.perf_counter() - self.started:.1f} s"
         )
 
 
-async def get_unread_messages(chat_id):
-    chat = await client.get_input_entity(chat_id)
-    result = await client(functions.messages.GetPeerDialogsRequest(
-        peers=[chat]
-    ))
+@dataclass(frozen=True)
+class ReadMarker:
+    peer: object
+    read_inbox_max_id: int
+    unread_count: int
+    top_message: int
+
+    @property
+    def min_id(self) -> int:
+        """
+        The id the scan starts after.
+
+        The stored checkpoint wins over the read marker: the marker also moves when the chat
+        is read on another device, which says nothing about what was evaluated here.
+        """
+        return db.get_resume_point(get_peer_id(self.peer)) or self.read_inbox_max_id
+
+    @property
+    def has_new_messages(self) -> bool:
+        return self.top_message > self.min_id
+
+
+async def _request_peer_dialogs(peers):
+    """Requests dialogs of many peers at once, splitting the batch when one peer breaks it."""
+    try:
+        result = await client(functions.messages.GetPeerDialogsRequest(peers=peers))
+        return list(result.dialogs)
+    except FloodWaitError as e:
+        logging.warning(f"FloodWait {e.seconds} s при запросе диалогов")
+        await asyncio.sleep(e.seconds)
+        return await _request_peer_dialogs(peers)
+    except Exception as e:
+        if len(peers) == 1:
+            logging.warning(f"Не удалось получить диалог {get_peer_id(peers[0])}: {e.__class__}: {e}")
+            return []
+        middle = len(peers) // 2
+        return await _request_peer_dialogs(peers[:middle]) + await _request_peer_dialogs(peers[middle:])
+
+
+async def fetch_read_markers(chat_ids):
+    """
+    Resolves input entities and read markers of the chats in batched GetPeerDialogsRequest calls.
+
+    Returns:
+        dict: chat id -> ReadMarker.
+    """
+    peers = {}
+    for chat_id in chat_ids:
+        try:
+            peers[chat_id] = await client.get_input_entity(chat_id)
+        except Exception as e:
+            logging.warning(f"Не удалось найти чат {chat_id}: {e.__class__}: {e}")
+    chat_list = list(peers)
+    markers = {}
+    for start in range(0, len(chat_list), PEER_DIALOGS_BATCH_SIZE):
+        batch = [peers[chat_id] for chat_id in chat_list[start:start + PEER_DIALOGS_BATCH_SIZE]]
+        for dialog in await _request_peer_dialogs(batch):
+            chat_id = get_peer_id(dialog.peer)
+            if chat_id in peers:
+                markers[chat_id] = ReadMarker(
+                    peers[chat_id], dialog.read_inbox_max_id, dialog.unread_count, dialog.top_message
+                )
+    return markers
+
+
+async def _backlog_slices(chat, min_id, top_id, semaphore: asyncio.Semaphore, cutoff):
+    """
+    Yields the backlog of a chat oldest first, in slices of up to BACKLOG_SLICE_SIZE messages.
+
+    Only messages after ``min_id`` up to ``top_id``, the newest one when the scan started, are read:
+    ingest workers already run, newer messages are evaluated live.
+
+    The semaphore is taken per request, not per chat: waiters are served in FIFO order,
+    so a chat with a long backlog goes back in line after every slice and the others
+    are interleaved with it instead of waiting for it to finish.
+    """
+    if BACKLOG_MAX_MESSAGES_PER_CHAT > 0:
+        # Only the newest messages are wanted: read them newest first and turn the list around
+        newest = []
+        async with semaphore:
+            async for message in client.iter_messages(
+                chat, min_id=min_id, max_id=top_id + 1, limit=BACKLOG_MAX_MESSAGES_PER_CHAT
+            ):
+                if cutoff and message.date < cutoff:
+                    break
+                newest.append(message)
+        newest.reverse()
+        for start in range(0, len(newest), BACKLOG_SLICE_SIZE):
+            yield newest[start:start + BACKLOG_SLICE_SIZE]
+        return
+
+    last_id = min_id
+    if cutoff:
+        # In reverse mode Telethon lets min_id override offset_date, so the scan starts after
+        # the newest message sent before the cutoff: one newest-first lookup finds it
+        async with semaphore:
+            stale = [message async for message in client.iter_messages(
+                chat, max_id=top_id + 1, offset_date=cutoff, limit=1
+            )]
+        if stale:
+            last_id = max(min_id, stale[0].id)
+    while True:
+        async with semaphore:
+            messages = [message async for message in client.iter_messages(
+                chat,
+                min_id=last_id,
+                max_id=top_id + 1,
+                limit=BACKLOG_SLICE_SIZE,
+                reverse=True
+            )]
+        if messages:
+            last_id = messages[-1].id
+            yield messages
+        if len(messages) < BACKLOG_SLICE_SIZE:
+            return
+
+
+async def get_unread_messages(chat_id, chat, min_id, top_id, semaphore: asyncio.Semaphore,
+                              progress: BacklogProgress, cutoff=None):
+    """
+    Scans the unread messages of a chat, grouping albums, and delivers the matches in batches.
+
+    While the scan runs the stored checkpoint stays at the last scanned message, so a crash
+    resumes the backlog where it stopped; the hold is released when the chat is done.
+    """
+    batch = BacklogBatch(chat_id, chat)
+    db.advance_checkpoint(chat_id, min_id)
+    db.hold_checkpoint(chat_id, min_id, "backlog")
     group = []
     group_id = -1
-    message = None
-    read_inbox_max_id = result.dialogs[0].read_inbox_max_id
-    async for message in client.iter_messages(
-            chat,
-            min_id=read_inbox_max_id,
-            reverse=True
-    ):
-        if not hasattr(message, "grouped_id") :
-            message.grouped_id = None
-        if group_id == message.grouped_id:
-            group.append(message)
-        else:
-            await analyse(group)
-            group = [message]
-            group_id = message.grouped_id or -1
-    await analyse(group)
+    scanned = 0
+    async for messages in _backlog_slices(chat, min_id, top_id, semaphore, cutoff):
+        for message in messages:
+            if not hasattr(message, "grouped_id"):
+                message.grouped_id = None
+            if group_id == message.grouped_id:
+                group.append(message)
+            else:
+                await analyse(group, batch)
+                group = [message]
+                group_id = message.grouped_id or -1
+        scanned += len(messages)
+        progress.add_messages(len(messages))
+    await analyse(group, batch)
+    batch.submit()
+    db.release_checkpoint(chat_id, "backlog")
+    progress.chat_done(chat_id, scanned)
+
+
+async def _process_chat(chat, marker, semaphore: asyncio.Semaphore, progress: BacklogProgress, cutoff):
+    try:
+        await get_unread_messages(chat, marker.peer, marker.min_id, marker.top_message, semaphore, progress, cutoff)
+    except Exception as e:
+        logging.exception(f"Ошибка обработки непрочитанных сообщений в id {chat}: {e.__class__}: {e}")
 
 
 async def process_unread_messages():
-    chats_to_process = db.get_tracked_chat_ids()
     me = await client.get_me()
     me = {me.id, TARGET_USER.id}
-    for chat in chats_to_process:
-        if chat in me:
-            continue
-        try:
-            await get_unread_messages(chat)
-        except Exception as e:
-            logging.error(f"Ошибка обработки непрочитанных сообщений в id {chat}: {e.__class__}: {e}\n"
-                          f"{traceback.print_exc()}")
+    tracked = [chat for chat in db.get_tracked_chat_ids() if chat not in me]
+    # Ingest workers already run: until a chat's backlog is done its checkpoint is kept where it was
+    for chat in tracked:
+        db.hold_checkpoint(chat, db.get_resume_point(chat), "backlog")
+    markers = await fetch_read_markers(tracked)
+    # Tasks take the semaphore in creation order, so critical chats are caught up first
+    chats_to_process = sorted(
+        (chat for chat, marker in markers.items() if marker.has_new_messages),
+        key=db.get_chat_priority,
+        reverse=True,
+    )
+    # Chats without a read marker keep the hold: they were not scanned, the next start does it
+    for chat in markers.keys() - set(chats_to_process):
+        db.release_checkpoint(chat, "backlog")
+    logging.info(f"Backlog :: {len(chats_to_process)} of {len(tracked)} tracked chats have unread messages")
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=BACKLOG_MAX_AGE_HOURS) if BACKLOG_MAX_AGE_HOURS > 0 else None
+    progress = BacklogProgress(len(chats_to_process))
+    semaphore = asyncio.Semaphore(max(1, BACKLOG_CONCURRENCY))
+    await asyncio.gather(*(
+        _process_chat(chat, markers[chat], semaphore, progress, cutoff) for chat in chats_to_process
+    ))
+    logging.info(
+        f"Backlog done :: {progress.done_chats}/{progress.total_chats} chats :: {progress.messages} messages "
+        f"in {time.perf_counter() - progress.started:.1f} s"
+    )
 
 
 if __name__ == "__main__":
-    import asyncio
-
     loop = asyncio.get_event_loop()
     loop.run_until_complete(process_unread_messages())
-
-    # loop.run_until_complete(get_unread_messages(-1001844767026))
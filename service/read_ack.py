@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Dict, Tuple
+
+from service.config import READ_ACK_INTERVAL_SECONDS, client
+from service.metrics import Counter
+
+READ_ACK_MARKS = Counter("read_ack_marks_total", "Processed messages reported to the read acknowledger.")
+READ_ACK_SENT = Counter("read_ack_sent_total", "Read acknowledgements sent to Telegram.")
+
+
+class ReadAcknowledger:
+    """
+    Coalesces read acknowledgements per chat.
+
+    Processed messages only move the highest read id of their chat, a background
+    task sends one acknowledgement per chat every ``interval`` seconds.
+    A chat can be held below some message for a reason: it is not acknowledged past the lowest
+    of its holds until they are released, then the highest id marked in the meantime is acknowledged.
+    """
+
+    def __init__(self, client, interval: float = 5):
+        self.client = client
+        self.interval = max(0.1, interval)
+        self._pending: Dict[int, Tuple[object, int]] = {}
+        self._holds: Dict[int, Dict[str, int]] = {}
+        self._held_marks: Dict[int, Tuple[object, int]] = {}
+        self._task: asyncio.Task | None = None
+
+    def hold(self, chat_id: int, max_id: int, reason: str) -> None:
+        self._holds.setdefault(chat_id, {})[reason] = max_id
+        limit = min(self._holds[chat_id].values())
+        pending = self._pending.get(chat_id)
+        if pending is not None and pending[1] > limit:
+            self._remember_held(chat_id, *pending)
+            del self._pending[chat_id]
+        self._mark_held(chat_id)
+
+    def release(self, chat_id: int, reason: str) -> None:
+        holds = self._holds.get(chat_id)
+        if not holds or holds.pop(reason, None) is None:
+            return
+        if not holds:
+            del self._holds[chat_id]
+        self._mark_held(chat_id)
+
+    def _mark_held(self, chat_id: int) -> None:
+        """Acknowledges as much of the marks made while the chat was held as its holds allow now."""
+        held = self._held_marks.pop(chat_id, None)
+        if held is not None:
+            self.mark(chat_id, *held)
+
+    def _remember_held(self, chat_id: int, entity, max_id: int) -> None:
+        held = self._held_marks.get(chat_id)
+        if held is None or held[1] < max_id:
+            self._held_marks[chat_id] = (entity, max_id)
+
+    def mark(self, chat_id: int, entity, max_id: int) -> None:
+        READ_ACK_MARKS.inc()
+        holds = self._holds.get(chat_id)
+        if holds and max_id > min(holds.values()):
+            self._remember_held(chat_id, entity, max_id)
+            max_id = min(holds.values())
+        if max_id <= 0:
+            return
+        pending = self._pending.get(chat_id)
+        if pending is None or pending[1] < max_id:
+            self._pending[chat_id] = (entity, max_id)
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        for chat_id, (entity, max_id) in pending.items():
+            try:
+                await self.client.send_read_acknowledge(entity, max_id=max_id)
+                READ_ACK_SENT.inc()
+            except Exception as exc:
+                logging.warning("Failed to acknowledge reading of %s up to %s: %s", chat_id, max_id, exc)
+                newer = self._pending.get(chat_id)
+                if newer is None or newer[1] < max_id:
+                    self._pending[chat_id] = (entity, max_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+
+read_acknowledger = ReadAcknowledger(client, READ_ACK_INTERVAL_SECONDS)
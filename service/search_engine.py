@@ -3,6 +3,7 @@ from nltk.tokenize import word_tokenize
 from service.nltk_init import stop_words
 from service.cache import Cache
 import string
+import time
 import pymorphy3
 from nltk.tokenize import sent_tokenize
 from nltk.stem import WordNetLemmatizer
@@ -64,10 +65,13 @@ def find_phrase(query, text):
     return max_similarity
 
 
-def find_queries(queries, text):
+def find_queries(queries, text, timings=None):
     res = {}
     for query in queries:
+        started = time.perf_counter()
         results = find_phrase(query, text)
+        if timings is not None:
+            timings[query] = time.perf_counter() - started
         if results > 55:
             res[query] = round(results, 2)
     return res
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+FINGERPRINT_BITS = 64
+# Bumped whenever fingerprints of the same text change, stored fingerprints are then recomputed
+FINGERPRINT_VERSION = 2
+# (normalized length below which the size applies, shingle size): short texts use shorter
+# shingles, otherwise a one-character edit changes too large a share of their features
+SHINGLE_SIZES = ((120, 2), (600, 3))
+SHINGLE_SIZE = 4
+MIN_TOKENS = 5
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _feature_hash(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+
+
+def _shingle_size(length: int) -> int:
+    for limit, size in SHINGLE_SIZES:
+        if length < limit:
+            return size
+    return SHINGLE_SIZE
+
+
+def text_fingerprint(text: str) -> Optional[int]:
+    """
+    Builds a 64-bit SimHash of the text from character shingles of its words.
+
+    The shingle size grows with the text length, see SHINGLE_SIZES.
+
+    Returns None for texts that are too short to be compared reliably.
+    """
+    tokens = _TOKEN_RE.findall((text or "").lower())
+    if len(tokens) < MIN_TOKENS:
+        return None
+    normalized = " ".join(tokens)
+    size = _shingle_size(len(normalized))
+    shingles = Counter(normalized[i:i + size] for i in range(len(normalized) - size + 1))
+    weights = [0] * FINGERPRINT_BITS
+    for shingle, count in shingles.items():
+        feature = _feature_hash(shingle)
+        while feature:
+            lowest = feature & -feature
+            weights[lowest.bit_length() - 1] += count
+            feature ^= lowest
+    total = sum(shingles.values())
+    fingerprint = 0
+    for bit, weight in enumerate(weights):
+        if 2 * weight > total:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(left: int, right: int) -> int:
+    return (left ^ right).bit_count()
+
+
+def similarity_to_distance(similarity: float) -> int:
+    """
+    Converts a similarity percentage into the maximal Hamming distance between fingerprints.
+
+    The percentage is the share of equal fingerprint bits, not of equal text: 90 allows 6 of 64 bits.
+    """
+    similarity = min(100.0, max(0.0, similarity))
+    return int(FINGERPRINT_BITS * (100.0 - similarity) / 100.0)
+
+
+class SimHashIndex:
+    """
+    A thread-safe LSH index of SimHash fingerprints.
+
+    Fingerprints are split into ``max_distance + 1`` bands, so by the pigeonhole principle
+    any two fingerprints within ``max_distance`` bits share at least one identical band.
+    Lookups only compare against the entries of matching band buckets.
+
+    Attributes:
+        max_distance (int): The maximal Hamming distance treated as a near-duplicate.
+        ttl (int | None): Lifetime of entries in seconds, entries never expire when not set.
+    """
+
+    def __init__(self, max_distance: int = 5, ttl: Optional[int] = None):
+        self.max_distance = max(0, min(max_distance, FINGERPRINT_BITS - 1))
+        self.ttl = ttl
+        bands = self.max_distance + 1
+        width, extra = divmod(FINGERPRINT_BITS, bands)
+        self._bands: List[Tuple[int, int]] = []
+        offset = 0
+        for band in range(bands):
+            size = width + (1 if band < extra else 0)
+            self._bands.append((offset, (1 << size) - 1))
+            offset += size
+        self._buckets: List[Dict[int, Set[Hashable]]] = [{} for _ in self._bands]
+        self._entries: Dict[Hashable, Tuple[int, float]] = {}
+        self._expiry_queue: deque = deque()
+        self.lock = threading.Lock()
+
+    def _band_values(self, fingerprint: int):
+        for index, (offset, mask) in enumerate(self._bands):
+            yield index, fingerprint >> offset & mask
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for index, value in self._band_values(entry[0]):
+            bucket = self._buckets[index].get(value)
+            if bucket is None:
+                continue
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[index][value]
+
+    def _expire(self) -> None:
+        current_time = time.time()
+        while self._expiry_queue and self._expiry_queue[0][0] < current_time:
+            expiry, key = self._expiry_queue.popleft()
+            entry = self._entries.get(key)
+            if entry and entry[1] == expiry:
+                self._remove(key)
+
+    def add(self, key: Hashable, fingerprint: int) -> None:
+        """
+        Adds or refreshes an entry of the index.
+
+        Args:
+            key: The key identifying the indexed text.
+            fingerprint: The SimHash fingerprint of the text.
+        """
+        expiry = time.time() + self.ttl if self.ttl else float("inf")
+        with self.lock:
+            self._expire()
+            self._remove(key)
+            self._entries[key] = (fingerprint, expiry)
+            for index, value in self._band_values(fingerprint):
+                self._buckets[index].setdefault(value, set()).add(key)
+            if self.ttl:
+                self._expiry_queue.append((expiry, key))
+
+    def discard(self, key: Hashable) -> None:
+        with self.lock:
+            self._remove(key)
+
+    def find(self, fingerprint: int) -> Optional[Tuple[Hashable, int]]:
+        """
+        Looks up the closest indexed fingerprint within ``max_distance`` bits.
+
+        Returns:
+            A tuple of the matched key and its distance, or None when nothing is close enough.
+        """
+        best = None
+        with self.lock:
+            self._expire()
+            seen: Set[Hashable] = set()
+            for index, value in self._band_values(fingerprint):
+                for key in self._buckets[index].get(value, ()):
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    distance = hamming_distance(fingerprint, self._entries[key][0])
+                    if distance <= self.max_distance and (best is None or distance < best[1]):
+                        best = (key, distance)
+        return best
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+            self._expiry_queue.clear()
+            for bucket in self._buckets:
+                bucket.clear()
+
+    def __len__(self) -> int:
+        with self.lock:
+            self._expire()
+            return len(self._entries)
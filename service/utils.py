@@ -1,5 +1,4 @@
 import logging
-import traceback
 
 from telethon.tl import types
 
@@ -12,25 +11,34 @@ async def get_message_source_link(message):
     location_link = ""
     chat_entity = {}
     try:
-        if not hasattr(message, 'ent'):
-            message.ent = await client.get_entity(message.chat_id)
-        chat_entity = message.ent
-        try:
-            if not chat_entity.username:
-                raise Exception
-            message_link = f"https://t.me/{chat_entity.username}/{message.id}"
-        except:
-            if message.peer_id:
-                message_link = f"https://t.me/c/{message.peer_id.channel_id}/{message.id}"
+        record = db.get_channel(message.chat_id)
+        if record:
+            username = record.username
+            invite_link = record.invite_link
+        else:
+            if not hasattr(message, 'ent'):
+                message.ent = await client.get_entity(message.chat_id)
+            chat_entity = message.ent
+            username = getattr(chat_entity, "username", None)
+            invite_link = None
+
+        peer = message.peer_id
+        channel_id = getattr(peer, "channel_id", None)
+        if username:
+            message_link = f"https://t.me/{username}/{message.id}"
+        elif channel_id:
+            message_link = f"https://t.me/c/{channel_id}/{message.id}"
 
-        if chat_entity.username:
-            location_link = f"https://t.me/{chat_entity.username}"
-        elif isinstance(message.peer_id, types.PeerChat):
+        if username:
+            location_link = f"https://t.me/{username}"
+        elif invite_link:
+            location_link = invite_link
+        elif isinstance(peer, types.PeerChat):
             location_link = f"https://t.me/c/{message.chat_id}"
-        elif isinstance(message.peer_id, types.PeerUser):
-            location_link = f"https://t.me/user/{chat_entity.id}"
+        elif isinstance(peer, types.PeerUser):
+            location_link = f"https://t.me/user/{peer.user_id}"
         else:
-            location_link = f"https://t.me/{message.peer_id.channel_id}"
+            location_link = f"https://t.me/{channel_id}"
 
         # if isinstance(entity, types.PeerChat):
         #     location_link = f"tg://join?invite={entity.access_hash}"
@@ -39,10 +47,9 @@ async def get_message_source_link(message):
         # elif isinstance(entity, types.PeerChannel):
         #     location_link = f"tg://resolve?domain={entity.channel_id}"
     except Exception as e:
-        logging.error("Get Link error: {e.__class__}: {e}\n"
-                      f"Message :: {message}\n"
-                      f"Entity :: {chat_entity}\n"
-                      f"{traceback.print_exc()}")
+        logging.exception(f"Get Link error: {e.__class__}: {e}\n"
+                          f"Message :: {message}\n"
+                          f"Entity :: {chat_entity}")
         pass
     return message_link, location_link
 
@@ -59,7 +66,7 @@ def format_user_name(entity):
     return full_name or "Unknown"
 
 
-def _extract_title_from_message(message):
+def extract_title_from_message(message):
     chat = getattr(message, "chat", None)
     if chat and getattr(chat, "title", None):
         return chat.title
@@ -73,7 +80,7 @@ def _extract_title_from_message(message):
 
 
 async def get_chat_name(message):
-    title = _extract_title_from_message(message)
+    title = extract_title_from_message(message)
     if title:
         return title
 
@@ -34,7 +34,7 @@ def _redirect(path: str, message: str | None = None) -> web.HTTPSeeOther:
     raise web.HTTPSeeOther(path)
 
 
-from . import cache, channels, groups, queries  # noqa: E402  # isort:skip
+from . import cache, channels, groups, metrics, queries  # noqa: E402  # isort:skip
 
 
 def create_app(client) -> web.Application:
@@ -45,6 +45,9 @@ def create_app(client) -> web.Application:
     app.add_routes(groups.routes)
     app.add_routes(channels.routes)
     app.add_routes(cache.routes)
+    app.add_routes(metrics.routes)
+    app.on_startup.append(metrics.start_loop_monitor)
+    app.on_cleanup.append(metrics.stop_loop_monitor)
     return app
 
 
@@ -5,7 +5,7 @@ import hashlib
 
 from aiohttp import web
 
-from service.main_handler import advanced_duplicate_cache, duplicate_cache
+from service.main_handler import advanced_duplicate_cache, duplicate_cache, near_duplicate_index
 from service.search_engine import cache as search_cache
 from service.db import db
 from . import render_template, _redirect
@@ -84,6 +84,7 @@ async def cache_overview(request: web.Request) -> web.Response:
         title="Кеш сообщений",
         caches=caches,
         total_entries=total_entries,
+        near_duplicate_entries=len(near_duplicate_index),
         ignored_messages=ignored,
         message=request.rel_url.query.get("msg"),
     )
@@ -39,6 +39,7 @@ async def channel_detail(request: web.Request) -> web.Response:
         queries=ordered_queries,
         assigned_queries=assigned,
         channel_groups=db.get_groups_for_channel(channel_id),
+        effective_priority=db.get_chat_priority(channel_id),
     )
 
 
@@ -53,6 +54,16 @@ async def update_channel_queries(request: web.Request) -> web.Response:
     _redirect(f"/channels/{channel_id}", "Связи обновлены")
 
 
+async def update_channel_priority(request: web.Request) -> web.Response:
+    channel_id = int(request.match_info["channel_id"])
+    data = await request.post()
+    try:
+        db.set_channel_priority(channel_id, int(data.get("priority") or 0))
+    except ValueError as exc:
+        _redirect(f"/channels/{channel_id}", str(exc))
+    _redirect(f"/channels/{channel_id}", "Приоритет обновлён")
+
+
 async def refresh_channels(request: web.Request) -> web.Response:
     client = request.app["tg_client"]
     try:
@@ -70,5 +81,6 @@ routes = [
     web.get("/channels", channels_page),
     web.get("/channels/{channel_id:-?\\d+}", channel_detail),
     web.post("/channels/{channel_id:-?\\d+}/queries", update_channel_queries),
+    web.post("/channels/{channel_id:-?\\d+}/priority", update_channel_priority),
     web.post("/channels/refresh", refresh_channels),
 ]
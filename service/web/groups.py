@@ -71,7 +71,8 @@ async def update_group(request: web.Request) -> web.Response:
     title = data.get("title", "")
     description = data.get("description", "")
     try:
-        db.update_channel_group(group_id, title, description)
+        priority = int(data.get("priority") or 0)
+        db.update_channel_group(group_id, title, description, priority)
     except ValueError as exc:
         _redirect(f"/groups/{group_id}", str(exc))
     _redirect(f"/groups/{group_id}", "Группа обновлена")
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import asyncio
+
+from aiohttp import web
+
+from service import metrics
+from service.db import db
+from service.main_handler import advanced_duplicate_cache, duplicate_cache, forwarded_verdicts, near_duplicate_index
+from service.search_engine import cache as search_cache
+
+CACHE_ENTRIES = metrics.Gauge("cache_entries", "Entries held by in-memory caches.", labels=("cache",))
+CACHE_ENTRIES.set_function(lambda: len(duplicate_cache), cache="duplicate")
+CACHE_ENTRIES.set_function(lambda: len(advanced_duplicate_cache), cache="sender_duplicate")
+CACHE_ENTRIES.set_function(lambda: len(near_duplicate_index), cache="near_duplicate")
+CACHE_ENTRIES.set_function(lambda: len(forwarded_verdicts), cache="forwarded_verdicts")
+CACHE_ENTRIES.set_function(lambda: len(search_cache), cache="tokenize")
+CACHE_ENTRIES.set_function(db.get_blocked_index_size, cache="blocked")
+CACHE_ENTRIES.set_function(db.get_channel_cache_size, cache="channels")
+
+LOOP_LAG = metrics.Gauge("event_loop_lag_seconds", "Last measured event loop lag.")
+LOOP_LAG_HISTOGRAM = metrics.Histogram("event_loop_lag_observed_seconds", "Observed event loop lag.")
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_loop_monitor(app: web.Application) -> None:
+    app["loop_lag_monitor"] = asyncio.create_task(metrics.monitor_event_loop_lag(LOOP_LAG, LOOP_LAG_HISTOGRAM))
+
+
+async def stop_loop_monitor(app: web.Application) -> None:
+    task = app.get("loop_lag_monitor")
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+routes = [
+    web.get("/metrics", metrics_endpoint),
+]
@@ -1,15 +1,26 @@
 from __future__ import annotations
 
+import asyncio
+import time
+
 from aiohttp import web
 
-from service.db import db
+from service.config import ARCHIVE_SEARCH_CANDIDATES
+from service.db import NOTIFY_MODES, db
+from service.search_engine import find_queries
 from . import render_template, _redirect
 
 
 async def index(request: web.Request) -> web.Response:
     message = request.rel_url.query.get("msg")
     queries = db.list_queries()
-    return render_template("queries.jinja2", title="Запросы", message=message, queries=queries)
+    return render_template(
+        "queries.jinja2",
+        title="Запросы",
+        message=message,
+        queries=queries,
+        query_stats=db.get_query_stats(),
+    )
 
 
 async def add_query(request: web.Request) -> web.Response:
@@ -40,6 +51,10 @@ async def query_detail(request: web.Request) -> web.Response:
         title=f"Запрос {record.id}",
         message=request.rel_url.query.get("msg"),
         query=record,
+        notify_modes=NOTIFY_MODES,
+        archive_enabled=db.archive_enabled,
+        stats=db.get_query_stats().get(query_id),
+        recent_matches=db.list_recent_matches(query_id),
         selected_channels=[channel for channel in channels if channel.id in assigned],
         available_channels=[channel for channel in channels if channel.id not in assigned],
         assigned_channels=assigned,
@@ -49,12 +64,46 @@ async def query_detail(request: web.Request) -> web.Response:
     )
 
 
+def _score_candidates(phrase: str, candidates):
+    results = []
+    for candidate in candidates:
+        res = find_queries((phrase,), (candidate["text"] or "").lower())
+        if res:
+            results.append({**candidate, "score": res[phrase]})
+    results.sort(key=lambda item: item["score"], reverse=True)
+    return results
+
+
+async def retro_search(request: web.Request) -> web.Response:
+    query_id = int(request.match_info["query_id"])
+    record = db.get_query(query_id)
+    if not record:
+        raise web.HTTPNotFound(text="Query not found")
+    if not db.archive_enabled:
+        _redirect(f"/queries/{query_id}", "Архив сообщений выключен (ARCHIVE_ENABLED)")
+    started = time.perf_counter()
+    candidates = db.search_archive(record.phrase, ARCHIVE_SEARCH_CANDIDATES)
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, _score_candidates, record.phrase, candidates)
+    return render_template(
+        "query_retro.jinja2",
+        title=f"Ретро-поиск: запрос {record.id}",
+        query=record,
+        results=results,
+        candidates_count=len(candidates),
+        candidates_limit=ARCHIVE_SEARCH_CANDIDATES,
+        archive_size=db.get_archive_size(),
+        elapsed=time.perf_counter() - started,
+    )
+
+
 async def update_query(request: web.Request) -> web.Response:
     query_id = int(request.match_info["query_id"])
     data = await request.post()
     phrase = data.get("phrase", "")
+    notify_mode = data.get("notify_mode", "")
     try:
-        db.update_query(query_id, phrase)
+        db.update_query(query_id, phrase, notify_mode)
     except ValueError as exc:
         _redirect(f"/queries/{query_id}", str(exc))
     _redirect(f"/queries/{query_id}", "Запрос обновлён")
@@ -75,4 +124,5 @@ routes = [
     web.get("/queries/{query_id:\\d+}", query_detail),
     web.post("/queries/{query_id:\\d+}", update_query),
     web.post("/queries/{query_id:\\d+}/channels", update_query_channels),
+    web.get("/queries/{query_id:\\d+}/retro", retro_search),
 ]
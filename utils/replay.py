@@ -0,0 +1,144 @@
+"""
+Replays a message stream through the real handler using the offline Telegram client.
+
+Examples:
+    DATA_DIRECTORY=/tmp/replay-data python -m utils.replay --rate 200 --count 5000
+    DATA_DIRECTORY=/tmp/replay-data python -m utils.replay --source data/messages --rate 0
+    DATA_DIRECTORY=/tmp/replay-data python -m utils.replay --source messages.jsonl --workers 8
+
+A source is a directory of .txt files (see collect_messages_for_test.py) or a JSONL
+file with {"chat_id": ..., "text": ...} lines. Without a source synthetic texts are
+built from the stored queries. Messages go to the tracked chats of the database in
+DATA_DIRECTORY, which must be set explicitly: the replay writes matches, query stats
+and checkpoints there, so point it to a copy of the production data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+os.environ.setdefault("TELEGRAM_FAKE_CLIENT", "1")
+# Checked before service.config loads .env, which may point to the production data
+if not os.getenv("DATA_DIRECTORY"):
+    sys.exit("Set DATA_DIRECTORY to a copy of the data directory, the replay writes to its database")
+
+from service.config import INGEST_LANES, client  # noqa: E402
+from service.db import db  # noqa: E402
+from service.delivery import delivery_queue  # noqa: E402
+from service.digest import digest_buffer  # noqa: E402
+from service.ingest import IngestQueue, chat_priority  # noqa: E402
+from service.main_handler import handle_new_message  # noqa: E402
+from service.read_ack import read_acknowledger  # noqa: E402
+
+FILLER = (
+    "сегодня завтра новости обсуждение цена город продам куплю обмен вопрос ответ "
+    "канал группа ссылка подробнее встреча работа проект срочно недорого доставка"
+).split()
+
+
+def load_source(source: str | None, chats, count: int):
+    if not source:
+        phrases = [query.phrase for query in db.list_queries()] or ["тестовый запрос"]
+        for _ in range(count):
+            words = random.choices(FILLER, k=random.randint(8, 40))
+            if random.random() < 0.05:
+                words.insert(random.randint(0, len(words)), random.choice(phrases))
+            words.append(str(random.randint(0, 10 ** 6)))
+            yield random.choice(chats), " ".join(words)
+        return
+
+    path = Path(source)
+    if path.is_dir():
+        texts = [item.read_text(encoding="utf-8") for item in sorted(path.glob("*.txt"))]
+        for index in range(count):
+            yield random.choice(chats), texts[index % len(texts)]
+        return
+
+    rows = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines() if line.strip()]
+    for index in range(count):
+        row = rows[index % len(rows)]
+        yield row.get("chat_id") or random.choice(chats), row["text"]
+
+
+def percentile(values, share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+async def replay(args) -> None:
+    chats = list(db.get_tracked_chat_ids())
+    if not chats:
+        print("No tracked chats in the database, assign queries to channels first")
+        return
+
+    # Messages at or below a chat's checkpoint are skipped as already evaluated
+    client.start_ids_after(max(db.get_checkpoint(chat) for chat in chats))
+    submitted_at = {}
+    latencies = []
+
+    async def timed_handler(message):
+        await handle_new_message(message)
+        latencies.append(time.perf_counter() - submitted_at[(message.chat_id, message.id)])
+
+    queue = IngestQueue(timed_handler, workers=args.workers, max_size=args.queue_size, overflow_policy="block",
+                        lanes=INGEST_LANES, priority_of=chat_priority)
+    delivery_queue.start()
+    read_acknowledger.start()
+    queue.start()
+
+    started = time.perf_counter()
+    interval = 1 / args.rate if args.rate > 0 else 0
+    for index, (chat_id, text) in enumerate(load_source(args.source, chats, args.count)):
+        if interval:
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        message = client.make_message(chat_id, text, sender_id=random.randint(1, 10 ** 6))
+        submitted_at[(message.chat_id, message.id)] = time.perf_counter()
+        await queue.submit(message)
+
+    await queue.join()
+    processed_in = time.perf_counter() - started
+    digest_buffer.flush()
+    await delivery_queue.stop(timeout=args.drain_timeout)
+    await read_acknowledger.stop()
+    await queue.stop()
+    total = time.perf_counter() - started
+
+    delivery_latencies = [
+        delivered - submitted_at[key] for key, delivered in client.delivered_at.items() if key in submitted_at
+    ]
+    print(f"Messages:            {len(latencies)}")
+    print(f"Processing time:     {processed_in:.2f} s ({len(latencies) / max(processed_in, 1e-9):.1f} msg/s)")
+    print(f"Total with delivery: {total:.2f} s")
+    if latencies:
+        print(f"Latency, ms:         p50={percentile(latencies, 0.5) * 1000:.1f} "
+              f"p95={percentile(latencies, 0.95) * 1000:.1f} "
+              f"p99={percentile(latencies, 0.99) * 1000:.1f} "
+              f"mean={statistics.fmean(latencies) * 1000:.1f}")
+    if delivery_latencies:
+        print(f"Delivery latency, s: p50={percentile(delivery_latencies, 0.5):.2f} "
+              f"p95={percentile(delivery_latencies, 0.95):.2f} max={max(delivery_latencies):.2f}")
+    print(f"Notifications sent:  {len(client.sent)}")
+    print("API calls:           " + ", ".join(f"{name}={count}" for name, count in sorted(client.calls.items())))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", help="Directory of .txt files or a JSONL file")
+    parser.add_argument("--count", type=int, default=1000, help="Number of messages to replay")
+    parser.add_argument("--rate", type=float, default=100, help="Messages per second, 0 for as fast as possible")
+    parser.add_argument("--workers", type=int, default=4, help="Ingest workers")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Ingest queue size")
+    parser.add_argument("--drain-timeout", type=float, default=600, help="Seconds to wait for deliveries")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for synthetic streams")
+    arguments = parser.parse_args()
+    random.seed(arguments.seed)
+    asyncio.run(replay(arguments))